@@ -1,15 +1,42 @@
 import struct
 import sys
 
+import numpy as np
+
+
+def decode_node_types(buf):
+    """
+    将深度优先节点流解码为节点类型数组（0 叶子 / 1 内部节点），按文件顺序排列
+    返回：(node_types, complete, leaf_truncated)
+        node_types     : uint8[N]，已读到的节点类型（末尾不完整的叶子也计入）
+        complete       : 整棵树是否完整解析（False 表示文件提前结束）
+        leaf_truncated : 文件是否结束在叶子节点的值中间
+    """
+    node_types = bytearray()
+    end = len(buf)
+    offset = 0
+    remaining = 1  # 尚未读取的节点数：每个内部节点再追加 8 个子节点
+    while remaining:
+        if offset >= end:
+            break  # EOF
+        node_type = buf[offset]
+        node_types.append(0 if node_type == 0 else 1)
+        remaining -= 1
+        if node_type == 0:
+            offset += 5  # 类型字节 + float32值
+            if offset > end:
+                break  # 叶子节点数据不完整
+        else:
+            offset += 1
+            remaining += 8
+    leaf_truncated = offset > end
+    return np.frombuffer(bytes(node_types), dtype=np.uint8), remaining == 0 and not leaf_truncated, leaf_truncated
+
 
 def count_octree_points(filename):
     """
     统计八叉树文件的体素点数
     """
-    total_points = 0
-    leaf_points = 0
-    internal_nodes = 0
-
     try:
         with open(filename, 'rb') as f:
             # 读取头部：3个uint32 (nx, ny, nz) - little-endian
@@ -24,39 +51,15 @@ def count_octree_points(filename):
             print(f"总体素数：{total_voxels:,}")
             print("-" * 50)
 
-            # 递归解析八叉树
-            def parse_node():
-                nonlocal total_points, leaf_points, internal_nodes
-
-                # 读取节点类型 (1字节)
-                node_type = f.read(1)
-                if len(node_type) == 0:
-                    return False  # EOF
+            # 一次性读入节点流并解码为节点类型数组，统计直接在数组上完成
+            node_types, complete, leaf_truncated = decode_node_types(f.read())
+            leaf_points = int(np.count_nonzero(node_types == 0))
+            internal_nodes = len(node_types) - leaf_points
+            total_points = len(node_types)  # 内部节点与叶子节点均计入
 
-                is_leaf = (node_type[0] == 0)
-
-                if is_leaf:
-                    # 叶子节点：读取float32值
-                    value_data = f.read(4)
-                    if len(value_data) < 4:
-                        print("错误：叶子节点数据不完整")
-                        return False
-
-                    leaf_points += 1
-                    total_points += 1  # 每个叶子节点代表至少1个体素
-                else:
-                    internal_nodes += 1
-                    total_points += 1  # 内部节点也贡献体素
-
-                    # 递归处理8个子节点
-                    for _ in range(8):
-                        if not parse_node():
-                            return False
-
-                return True
-
-            # 开始解析
-            if parse_node():
+            if leaf_truncated:
+                print("错误：叶子节点数据不完整")
+            if complete:
                 print(f"\n八叉树统计：")
                 print(f"总节点数：{total_points:,}")
                 print(f"叶子节点数：{leaf_points:,}")
@@ -95,14 +98,23 @@ def detailed_octree_analysis(filename):
             # 跟踪当前级别和节点尺寸
             level_stats = {}
 
-            def parse_node_detailed(size_x, size_y, size_z, current_level):
-                nonlocal f
+            node_types, _, _ = decode_node_types(f.read())
+            n_nodes = len(node_types)
+            index = 0
 
-                node_type = f.read(1)
-                if len(node_type) == 0:
-                    return 0, 0, 0
+            total_voxels_counted = 0
+            total_leaves = 0
+            total_internals = 0
 
-                is_leaf = (node_type[0] == 0)
+            # 迭代深度优先遍历：栈中保存待解析节点的 (size_x, size_y, size_z, level)
+            stack = [(nx, ny, nz, 0)]
+            while stack:
+                size_x, size_y, size_z, current_level = stack.pop()
+
+                if index >= n_nodes:
+                    break  # EOF：剩余节点均无法解析
+                is_leaf = (node_types[index] == 0)
+                index += 1
                 voxels_in_node = size_x * size_y * size_z
 
                 # 统计每个级别的信息
@@ -111,17 +123,14 @@ def detailed_octree_analysis(filename):
 
                 if is_leaf:
                     # 叶子节点
-                    f.read(4)  # 跳过值
                     level_stats[current_level]['leaves'] += 1
                     level_stats[current_level]['voxels'] += voxels_in_node
-                    return voxels_in_node, 1, 0
+                    total_voxels_counted += voxels_in_node
+                    total_leaves += 1
                 else:
                     # 内部节点
                     level_stats[current_level]['internals'] += 1
-
-                    total_voxels_in_subtree = 0
-                    total_leaf_nodes = 0
-                    total_internal_nodes = 0
+                    total_internals += 1
 
                     # 计算子节点尺寸
                     half_x = (size_x + 1) // 2
@@ -139,15 +148,9 @@ def detailed_octree_analysis(filename):
                         (size_x - half_x, size_y - half_y, size_z - half_z)
                     ]
 
-                    for child_size in child_sizes:
-                        cvx, cly, cin = parse_node_detailed(*child_size, current_level + 1)
-                        total_voxels_in_subtree += cvx
-                        total_leaf_nodes += cly
-                        total_internal_nodes += cin
-
-                    return total_voxels_in_subtree, total_leaf_nodes, total_internal_nodes + 1
-
-            total_voxels_counted, total_leaves, total_internals = parse_node_detailed(nx, ny, nz, 0)
+                    # 逆序入栈，保证出栈顺序与文件中的子节点顺序一致
+                    for child_size in reversed(child_sizes):
+                        stack.append((*child_size, current_level + 1))
 
             print(f"\n详细统计：")
             print(f"总表示体素数：{total_voxels_counted:,}")
@@ -1,69 +1,153 @@
+import struct
 
 import numpy as np
-
-
-class OctreeNode:
-    def __init__(self, min_coord, size, data):
-        minx, miny, minz = min_coord
-        sx, sy, sz = size
-        sub_data = data[minz:minz + sz, miny:miny + sy, minx:minx + sx]
+from numba import njit
+
+# File header: nx, ny, nz as little-endian uint32
+HEADER = struct.Struct('<III')
+
+# Child (dx, dy, dz) offsets in file order; child min = parent min + offset * half
+CHILD_OFFSETS = np.array([
+    [0, 0, 0], [0, 0, 1], [0, 1, 0], [0, 1, 1],
+    [1, 0, 0], [1, 0, 1], [1, 1, 0], [1, 1, 1],
+], dtype=np.int32)
+
+
+@njit(cache=True)
+def build_octree(data_3d, fluct_thresh=50.0):
+    """
+    Build the octree iteratively over a (z, y, x) float32 volume.
+
+    Nodes are emitted in the same depth-first order the file format uses:
+    node_types holds 0 (leaf) / 1 (internal) per node and leaf_values holds
+    one value per leaf, in the order the leaves are visited.
+    """
+    nz, ny, nx = data_3d.shape
+
+    # Every level at most halves the largest extent; 8 stack rows per level
+    # bound the pending siblings of the current DFS path.
+    max_depth = 1
+    extent = max(nx, ny, nz)
+    while extent > 1:
+        extent = (extent + 1) // 2
+        max_depth += 1
+    stack = np.empty((max_depth * 8, 6), np.int32)
+
+    capacity = 1024
+    node_types = np.empty(capacity, np.uint8)
+    leaf_values = np.empty(capacity, np.float32)
+    n_nodes = 0
+    n_leaves = 0
+
+    stack[0, 0] = 0
+    stack[0, 1] = 0
+    stack[0, 2] = 0
+    stack[0, 3] = nx
+    stack[0, 4] = ny
+    stack[0, 5] = nz
+    top = 1
+
+    while top > 0:
+        top -= 1
+        minx = stack[top, 0]
+        miny = stack[top, 1]
+        minz = stack[top, 2]
+        sx = stack[top, 3]
+        sy = stack[top, 4]
+        sz = stack[top, 5]
+
+        # Grow output buffers (leaf_values never outgrows node_types)
+        if n_nodes == capacity:
+            capacity *= 2
+            grown_types = np.empty(capacity, np.uint8)
+            grown_types[:n_nodes] = node_types[:n_nodes]
+            node_types = grown_types
+            grown_values = np.empty(capacity, np.float32)
+            grown_values[:n_leaves] = leaf_values[:n_leaves]
+            leaf_values = grown_values
 
         # Base case: if any dimension is too small to subdivide or only one voxel
         if sx <= 1 and sy <= 1 and sz <= 1:
-            self.is_leaf = True
-            self.value = sub_data.flatten()[0] if sub_data.size > 0 else 0.0
-            self.children = None
-            return
-
-        vals = sub_data.flatten()
-        if vals.size == 0:
-            self.is_leaf = True
-            self.value = 0.0
-            self.children = None
-            return
-
-        fluctuation = np.max(vals) - np.min(vals)
-
-        if fluctuation <= 50:
-            self.is_leaf = True
-            self.value = np.mean(vals)
-            self.children = None
-        else:
-            # Check if we can subdivide
-            if min(sx, sy, sz) < 2:
-                self.is_leaf = True
-                self.value = np.mean(vals)
-                self.children = None
-                return
-
-            self.is_leaf = False
-            self.children = []
-
-            # Compute half sizes for each dimension
-            halfx = (sx + 1) // 2
-            halfy = (sy + 1) // 2
-            halfz = (sz + 1) // 2
-
-            # Create 8 children
-            for dx in [0, 1]:
-                for dy in [0, 1]:
-                    for dz in [0, 1]:
-                        cx = minx + dx * halfx
-                        cy = miny + dy * halfy
-                        cz = minz + dz * halfz
-                        csx = halfx if dx == 0 else sx - halfx
-                        csy = halfy if dy == 0 else sy - halfy
-                        csz = halfz if dz == 0 else sz - halfz
-                        self.children.append(OctreeNode((cx, cy, cz), (csx, csy, csz), data))
-
-    def save(self, f):
-        if self.is_leaf:
-            f.write(b'\x00')
-            f.write(np.array([self.value], dtype='<f4').tobytes())
-        else:
-            f.write(b'\x01')
-            for child in self.children:
-                child.save(f)
+            node_types[n_nodes] = 0
+            leaf_values[n_leaves] = data_3d[minz, miny, minx] if sx * sy * sz > 0 else 0.0
+            n_nodes += 1
+            n_leaves += 1
+            continue
+
+        if sx * sy * sz == 0:
+            node_types[n_nodes] = 0
+            leaf_values[n_leaves] = 0.0
+            n_nodes += 1
+            n_leaves += 1
+            continue
+
+        # Single pass min/max/sum; a splittable block stops scanning as soon
+        # as its fluctuation exceeds the threshold.
+        can_split = min(sx, sy, sz) >= 2
+        lo = data_3d[minz, miny, minx]
+        hi = lo
+        total = 0.0
+        split = False
+        for iz in range(minz, minz + sz):
+            for iy in range(miny, miny + sy):
+                for ix in range(minx, minx + sx):
+                    v = data_3d[iz, iy, ix]
+                    if v < lo:
+                        lo = v
+                    elif v > hi:
+                        hi = v
+                    total += v
+                if can_split and hi - lo > fluct_thresh:
+                    split = True
+                    break
+            if split:
+                break
+
+        if not split:
+            node_types[n_nodes] = 0
+            leaf_values[n_leaves] = total / (sx * sy * sz)
+            n_nodes += 1
+            n_leaves += 1
+            continue
+
+        node_types[n_nodes] = 1
+        n_nodes += 1
+
+        # Compute half sizes for each dimension
+        halfx = (sx + 1) // 2
+        halfy = (sy + 1) // 2
+        halfz = (sz + 1) // 2
+
+        # Push the 8 children in reverse so they pop in file order. Sizes are
+        # branchless: half for offset 0, the remainder for offset 1.
+        for child in range(7, -1, -1):
+            dx = CHILD_OFFSETS[child, 0]
+            dy = CHILD_OFFSETS[child, 1]
+            dz = CHILD_OFFSETS[child, 2]
+            stack[top, 0] = minx + dx * halfx
+            stack[top, 1] = miny + dy * halfy
+            stack[top, 2] = minz + dz * halfz
+            stack[top, 3] = halfx + dx * (sx - 2 * halfx)
+            stack[top, 4] = halfy + dy * (sy - 2 * halfy)
+            stack[top, 5] = halfz + dz * (sz - 2 * halfz)
+            top += 1
+
+    return node_types[:n_nodes], leaf_values[:n_leaves]
+
+
+def interleave_nodes(node_types, leaf_values):
+    """
+    Lay out the DFS stream expected by readers: one type byte per node,
+    each leaf byte followed by its little-endian float32 value.
+    """
+    sizes = np.where(node_types == 0, 5, 1)
+    offsets = np.cumsum(sizes) - sizes
+    stream = np.empty(int(sizes.sum()), dtype=np.uint8)
+    stream[offsets] = node_types
+    leaf_offsets = offsets[node_types == 0] + 1
+    leaf_bytes = leaf_values.astype('<f4').view(np.uint8).reshape(-1, 4)
+    stream[leaf_offsets[:, None] + np.arange(4)] = leaf_bytes
+    return stream
 
 
 def main():
@@ -73,22 +157,24 @@ def main():
     # Dimensions from the format
     nx, ny, nz = 676, 676, 210
 
-    # Read binary data: big-endian float32
-    data = np.fromfile(input_file, dtype='>f4').reshape(nz, ny, nx)  # Assuming order: z, y, x
+    # Read binary data: big-endian float32, swapped in place to native order for numba
+    data = np.fromfile(input_file, dtype='>f4')
+    data.byteswap(inplace=True)
+    data = data.view(np.float32).reshape(nz, ny, nx)  # Assuming order: z, y, x
 
     # Build octree
-    root = OctreeNode((0, 0, 0), (nx, ny, nz), data)
+    node_types, leaf_values = build_octree(data)
 
     # Save to file: little-endian
     output_file = 'octree.bin'
     with open(output_file, 'wb') as f:
         # Write header: dimensions as uint32 little-endian
-        f.write(np.array([nx, ny, nz], dtype='<u4').tobytes())
+        f.write(HEADER.pack(nx, ny, nz))
         # Save the tree
-        root.save(f)
+        interleave_nodes(node_types, leaf_values).tofile(f)
 
     print(f"Octree saved to {output_file}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
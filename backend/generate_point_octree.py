@@ -1,145 +1,156 @@
+import struct
+
 import numpy as np
+from numba import njit
 
+# 文件头部：维度 nx, ny, nz（little-endian uint32）
+HEADER = struct.Struct('<III')
 
-class PointOctreeNode:
-    """
-    点八叉树节点类，每个叶子节点代表一个采样点而不是体素块
-    """
+# 子节点偏移表 (dx, dy, dz)，按文件中的子节点顺序（dz 最外层、dx 最内层）排列
+# 子节点起点 = 父节点起点 + 偏移 × 一半大小
+CHILD_OFFSETS = np.array([
+    [0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 1, 0],
+    [0, 0, 1], [1, 0, 1], [0, 1, 1], [1, 1, 1],
+], dtype=np.int32)
 
-    def __init__(self, min_coord, size, data, max_depth=10, current_depth=0):
-        minx, miny, minz = min_coord
-        sx, sy, sz = size
 
-        # 检查是否达到最大深度或空间太小
-        if current_depth >= max_depth or min(sx, sy, sz) <= 1:
-            self.is_leaf = True
-            # 选择该区域的代表性采样点（中心点）
+@njit(cache=True, boundscheck=False)
+def build_point_octree(data, max_depth, thresh=50.0):
+    """
+    以显式栈迭代构建点八叉树，每个叶子节点代表一个采样点（区域中心点）而不是体素块
+
+    参数：
+        data      : (z, y, x) 本机字节序 float32 体数据
+        max_depth : 最大八叉树深度
+        thresh    : 波动阈值，区域 max - min 不超过该值即成为叶子
+    返回（均按深度优先的保存顺序排列）：
+        node_types     : uint8[N]，0 叶子 / 1 内部节点
+        leaf_values    : float32[K]，叶子采样点的标量值
+        leaf_positions : float32[K, 3]，叶子采样点坐标 (x, y, z)
+    """
+    nz, ny, nx = data.shape
+
+    # 栈行：(minx, miny, minz, sx, sy, sz, depth)；每层最多压入 8 个兄弟节点
+    stack = np.empty(((max_depth + 1) * 8, 7), np.int32)
+    stack[0, 0] = 0
+    stack[0, 1] = 0
+    stack[0, 2] = 0
+    stack[0, 3] = nx
+    stack[0, 4] = ny
+    stack[0, 5] = nz
+    stack[0, 6] = 0
+    top = 1
+
+    capacity = 1024
+    node_types = np.empty(capacity, np.uint8)
+    leaf_values = np.empty(capacity, np.float32)
+    leaf_positions = np.empty((capacity, 3), np.float32)
+    n_nodes = 0
+    n_leaves = 0
+
+    while top > 0:
+        top -= 1
+        minx = stack[top, 0]
+        miny = stack[top, 1]
+        minz = stack[top, 2]
+        sx = stack[top, 3]
+        sy = stack[top, 4]
+        sz = stack[top, 5]
+        depth = stack[top, 6]
+
+        # 输出缓冲区满时倍增扩容（叶子数不会超过节点数）
+        if n_nodes == capacity:
+            capacity *= 2
+            grown_types = np.empty(capacity, np.uint8)
+            grown_types[:n_nodes] = node_types[:n_nodes]
+            node_types = grown_types
+            grown_values = np.empty(capacity, np.float32)
+            grown_values[:n_leaves] = leaf_values[:n_leaves]
+            leaf_values = grown_values
+            grown_positions = np.empty((capacity, 3), np.float32)
+            grown_positions[:n_leaves] = leaf_positions[:n_leaves]
+            leaf_positions = grown_positions
+
+        # 达到最大深度或空间太小时直接成为叶子；否则计算区域波动性，
+        # 一旦 max - min 超过阈值即可判定需要细分，提前结束扫描
+        split = False
+        if depth < max_depth and min(sx, sy, sz) > 1:
+            lo = data[minz, miny, minx]
+            hi = lo
+            for iz in range(minz, minz + sz):
+                for iy in range(miny, miny + sy):
+                    for ix in range(minx, minx + sx):
+                        v = data[iz, iy, ix]
+                        if v < lo:
+                            lo = v
+                        elif v > hi:
+                            hi = v
+                    if hi - lo > thresh:
+                        split = True
+                        break
+                if split:
+                    break
+
+        if not split:
+            # 叶子节点：选择该区域的代表性采样点（中心点）
             center_x = minx + sx // 2
             center_y = miny + sy // 2
             center_z = minz + sz // 2
-
-            # 获取中心点的值作为该节点的代表值
-            if 0 <= center_x < data.shape[2] and 0 <= center_y < data.shape[1] and 0 <= center_z < data.shape[0]:
-                self.value = data[center_z, center_y, center_x]
+            node_types[n_nodes] = 0
+            if 0 <= center_x < nx and 0 <= center_y < ny and 0 <= center_z < nz:
+                leaf_values[n_leaves] = data[center_z, center_y, center_x]
             else:
-                self.value = 0.0
-
-            self.position = (center_x, center_y, center_z)  # 存储采样点坐标
-            self.children = None
-            return
-
-        # 获取该子空间的数据
-        sub_data = data[minz:minz + sz, miny:miny + sy, minx:minx + sx]
-        vals = sub_data.flatten()
-
-        if vals.size == 0:
-            self.is_leaf = True
-            self.value = 0.0
-            # 使用区域中心作为默认位置
-            self.position = (minx + sx // 2, miny + sy // 2, minz + sz // 2)
-            self.children = None
-            return
-
-        # 计算该区域的波动性
-        fluctuation = np.max(vals) - np.min(vals)
-
-        if fluctuation <= 50:
-            # 波动小，创建叶子节点（采样中心点）
-            self.is_leaf = True
-            center_x = minx + sx // 2
-            center_y = miny + sy // 2
-            center_z = minz + sz // 2
+                leaf_values[n_leaves] = 0.0
+            leaf_positions[n_leaves, 0] = center_x
+            leaf_positions[n_leaves, 1] = center_y
+            leaf_positions[n_leaves, 2] = center_z
+            n_nodes += 1
+            n_leaves += 1
+            continue
+
+        # 内部节点：计算各维度的一半大小，创建8个子节点
+        node_types[n_nodes] = 1
+        n_nodes += 1
+        halfx = (sx + 1) // 2
+        halfy = (sy + 1) // 2
+        halfz = (sz + 1) // 2
+
+        # 逆序入栈，使子节点按偏移表顺序出栈；
+        # 尺寸无分支计算：偏移为 0 取一半，偏移为 1 取剩余部分
+        for child in range(7, -1, -1):
+            dx = CHILD_OFFSETS[child, 0]
+            dy = CHILD_OFFSETS[child, 1]
+            dz = CHILD_OFFSETS[child, 2]
+            stack[top, 0] = minx + dx * halfx
+            stack[top, 1] = miny + dy * halfy
+            stack[top, 2] = minz + dz * halfz
+            stack[top, 3] = halfx + dx * (sx - 2 * halfx)
+            stack[top, 4] = halfy + dy * (sy - 2 * halfy)
+            stack[top, 5] = halfz + dz * (sz - 2 * halfz)
+            stack[top, 6] = depth + 1
+            top += 1
+
+    return node_types[:n_nodes], leaf_values[:n_leaves], leaf_positions[:n_leaves]
+
+
+def interleave_nodes(node_types, leaf_values, leaf_positions):
+    """
+    将节点数组排布为点八叉树文件的节点流
+    格式：节点类型(1字节) + [如果是叶子：值(4字节) + x(4字节) + y(4字节) + z(4字节)]
+          [如果是内部节点：其后紧跟 8 个子节点]
+    """
+    # 叶子负载：标量值 + 3D坐标，均为 little-endian float32
+    leaf_payload = np.empty((len(leaf_values), 4), dtype='<f4')
+    leaf_payload[:, 0] = leaf_values
+    leaf_payload[:, 1:] = leaf_positions
 
-            if 0 <= center_x < data.shape[2] and 0 <= center_y < data.shape[1] and 0 <= center_z < data.shape[0]:
-                self.value = data[center_z, center_y, center_x]
-            else:
-                self.value = np.mean(vals) if vals.size > 0 else 0.0
-
-            self.position = (center_x, center_y, center_z)
-            self.children = None
-        else:
-            # 波动大，需要细分
-            if min(sx, sy, sz) < 2:
-                # 空间太小，无法进一步细分，创建叶子节点
-                self.is_leaf = True
-                center_x = minx + sx // 2
-                center_y = miny + sy // 2
-                center_z = minz + sz // 2
-
-                if 0 <= center_x < data.shape[2] and 0 <= center_y < data.shape[1] and 0 <= center_z < data.shape[0]:
-                    self.value = data[center_z, center_y, center_x]
-                else:
-                    self.value = np.mean(vals) if vals.size > 0 else 0.0
-
-                self.position = (center_x, center_y, center_z)
-                self.children = None
-                return
-
-            # 创建内部节点
-            self.is_leaf = False
-            self.children = []
-
-            # 计算各维度的一半大小
-            halfx = (sx + 1) // 2
-            halfy = (sy + 1) // 2
-            halfz = (sz + 1) // 2
-
-            # 创建8个子节点
-            for dz in [0, 1]:
-                for dy in [0, 1]:
-                    for dx in [0, 1]:
-                        cx = minx + dx * halfx
-                        cy = miny + dy * halfy
-                        cz = minz + dz * halfz
-                        csx = halfx if dx == 0 else sx - halfx
-                        csy = halfy if dy == 0 else sy - halfy
-                        csz = halfz if dz == 0 else sz - halfz
-
-                        # 递归创建子节点，传递当前深度
-                        child_node = PointOctreeNode(
-                            (cx, cy, cz),
-                            (csx, csy, csz),
-                            data,
-                            max_depth,
-                            current_depth + 1
-                        )
-                        self.children.append(child_node)
-
-    def save(self, f):
-        """
-        保存点八叉树节点到文件
-        格式：节点类型(1字节) + [如果是叶子：值(4字节) + x(4字节) + y(4字节) + z(4字节)]
-              [如果是内部节点：直接递归保存子节点]
-        """
-        if self.is_leaf:
-            # 叶子节点：类型0 + 标量值 + 3D坐标
-            f.write(b'\x00')
-            # 写入标量值 (little-endian float32)
-            f.write(np.array([self.value], dtype='<f4').tobytes())
-            # 写入坐标 (little-endian float32，每个坐标4字节)
-            coords = np.array(self.position, dtype='<f4')
-            f.write(coords.tobytes())
-        else:
-            # 内部节点：类型1 + 8个子节点
-            f.write(b'\x01')
-            for child in self.children:
-                child.save(f)
-
-    def get_leaf_points(self):
-        """
-        获取所有叶子节点（采样点）的列表
-        返回：[(x, y, z, value), ...] 格式的列表
-        """
-        points = []
-
-        if self.is_leaf:
-            x, y, z = self.position
-            points.append((x, y, z, self.value))
-        else:
-            for child in self.children:
-                points.extend(child.get_leaf_points())
-
-        return points
+    sizes = np.where(node_types == 0, 17, 1)
+    offsets = np.cumsum(sizes) - sizes
+    stream = np.empty(int(sizes.sum()), dtype=np.uint8)
+    stream[offsets] = node_types
+    leaf_offsets = offsets[node_types == 0] + 1
+    stream[leaf_offsets[:, None] + np.arange(16)] = leaf_payload.view(np.uint8)
+    return stream
 
 
 def main():
@@ -155,9 +166,11 @@ def main():
     print(f"正在从体素数据构建点八叉树...")
     print(f"输入维度：{nx} × {ny} × {nz}")
 
-    # 读取二进制数据：大端序 float32
+    # 读取二进制数据：大端序 float32，原地转为本机字节序供 numba 使用
     print("读取体素数据...")
-    data = np.fromfile(input_file, dtype='>f4').reshape(nz, ny, nx)
+    data = np.fromfile(input_file, dtype='>f4')
+    data.byteswap(inplace=True)
+    data = data.view(np.float32).reshape(nz, ny, nx)
     print(f"数据范围：[{data.min():.2f}, {data.max():.2f}]")
 
     # 计算最大深度（基于较小维度）
@@ -166,15 +179,13 @@ def main():
 
     # 构建点八叉树
     print("构建点八叉树...")
-    root = PointOctreeNode((0, 0, 0), (nx, ny, nz), data, max_depth=max_depth)
+    node_types, leaf_values, leaf_positions = build_point_octree(data, max_depth)
 
-    # 获取所有采样点用于验证
-    all_points = root.get_leaf_points()
-    print(f"生成采样点数量：{len(all_points):,}")
+    # 采样点用于验证
+    print(f"生成采样点数量：{len(leaf_values):,}")
 
-    if all_points:
-        point_values = [p[3] for p in all_points]
-        print(f"采样点值范围：[{min(point_values):.2f}, {max(point_values):.2f}]")
+    if len(leaf_values):
+        print(f"采样点值范围：[{leaf_values.min():.2f}, {leaf_values.max():.2f}]")
 
     # 保存到文件：小端序
     output_file = 'point_octree.bin'
@@ -182,13 +193,13 @@ def main():
 
     with open(output_file, 'wb') as f:
         # 写入头部：维度 (little-endian uint32)
-        f.write(np.array([nx, ny, nz], dtype='<u4').tobytes())
-        # 保存八叉树结构
-        root.save(f)
+        f.write(HEADER.pack(nx, ny, nz))
+        # 保存八叉树结构（一次性写出整个节点流）
+        interleave_nodes(node_types, leaf_values, leaf_positions).tofile(f)
 
     # 计算文件大小
     file_size = os.path.getsize(output_file)
-    points_per_byte = len(all_points) / file_size if file_size > 0 else 0
+    points_per_byte = len(leaf_values) / file_size if file_size > 0 else 0
     print(f"文件大小：{file_size / 1024:.1f} KB")
     print(f"每字节存储点数：{points_per_byte:.2f}")
     print(f"点八叉树保存完成：{output_file}")
@@ -6,9 +6,9 @@
 
 主要特性：
     - 接收前端 JSON 参数：min_val、max_val（数值筛选范围）、colormap（颜色映射名称）。
-    - 读取 Saltf 文件（大端 float32），重构体数据并构建三维坐标网格。
-    - 根据阈值范围筛选点，将体素值归一化后映射到颜色（RGB，uint8）。
-    - 以 PLY（小端二进制）格式返回点云文件（包含 x/y/z + r/g/b）。
+    - 读取 Saltf 文件（大端 float32），重构为三维体数据。
+    - 根据阈值范围筛选点（仅对命中体素由索引计算坐标），将体素值归一化后映射到颜色（RGB，uint8）。
+    - 以 PLY（小端二进制）格式返回点云文件（包含 x/y/z + r/g/b），经临时文件发送，响应关闭后删除。
 
 接口：
     POST /generate-ply
@@ -18,26 +18,26 @@
 依赖：
     - Flask, flask_cors
     - numpy
-    - plyfile
     - matplotlib（仅用于 colormap 取色）
     - Python 3.x
 
 注意与限制：
-    - Saltf 文件需与脚本同目录（或修改 input_file）。
-    - 阈值范围若筛选不到任何点，当前代码会在归一化前对 values_vals.min()/max() 调用导致异常（空数组求 min/max）。
-      *保持原逻辑*：本文件未调整执行顺序；生产中建议先判断筛选结果是否为空，再做归一化与配色。
-    - brightness_factor 调低亮度，提升细节辨识度（可按需调整或暴露为参数）。
+    - Saltf 文件需与脚本同目录（或修改 input_file）；启动时加载（首次启动生成小端副本 Saltf.f32，需目录可写），
+      文件缺失或尺寸不符时启动即失败。
+    - 阈值范围若筛选不到任何点（包括整体落在数据值域之外），在二分查找后立即返回 400，不做归一化与配色。
+    - BRIGHTNESS_FACTOR 调低亮度，提升细节辨识度（可按需调整或暴露为参数）。
     - 大数据集（210×676×676）内存占用与计算量较大，部署时注意内存与响应时间。
 """
 
 from flask import Flask, request, Response, send_file
-from io import BytesIO
+import tempfile
 import numpy as np
-from plyfile import PlyData, PlyElement
 from flask_cors import CORS
 import os
+import shutil
 import matplotlib.pyplot as plt  # noqa: F401  # 仅用于确保 matplotlib 后端可用
-from matplotlib import cm        # 用于获取 colormap
+from matplotlib import colormaps  # 用于获取 colormap
+from numba import njit, prange
 
 # ===== 路径与应用初始化 =====
 # 获取当前脚本所在目录的绝对路径，便于定位同目录资源文件（Saltf）
@@ -47,6 +47,132 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 app = Flask(__name__)
 CORS(app)
 
+# ===== 数据体维度与文件路径配置 =====
+input_file = os.path.join(current_dir, 'Saltf')  # Saltf 文件路径（与脚本同目录）
+n1, n2, n3 = 210, 676, 676                       # 体素维度（X, Y, Z）
+spacing = (20.0, 20.0, 20.0)                     # 各轴方向物理间距（单位：同源数据单位，示例 mm）
+origin = (0.0, 0.0, 0.0)                         # 原点坐标（用于生成物理坐标）
+
+# ===== 体数据加载（启动时一次） =====
+def load_volume(input_file, shape):
+    """
+    以只读内存映射方式加载 Saltf 体数据，返回本机小端 float32 三维数组 (Z, Y, X)，仅在启动时调用一次。
+    Saltf 为大端 float32：首次启动（或 Saltf 更新后）一次性转换为同目录下的小端副本（<input_file>.f32），
+    之后直接 np.memmap 映射该副本，由操作系统按需换页、在多个进程间共享页缓存，
+    请求无需再读取整个文件或交换字节序。
+    同时建立值域索引：按体素值排序后的值数组及其对应的展平下标（argsort 排列，int32），
+    请求时用两次 searchsorted 即可定位阈值区间内的全部体素。
+    文件体素数与 shape 不一致时抛出 ValueError。
+
+    返回：(data, sorted_values, sort_order)
+    """
+    expected_size = int(np.prod(shape))
+    actual_size = os.path.getsize(input_file) // 4
+    if actual_size != expected_size:
+        raise ValueError(f"预期数据点数 {expected_size}，实际得到 {actual_size}")
+
+    converted_file = input_file + '.f32'
+    if not os.path.exists(converted_file) or os.path.getmtime(converted_file) < os.path.getmtime(input_file):
+        # 复制后在可写内存映射上原地转小端，不经 Python 堆；先写临时文件再原子替换，避免并发进程读到半成品
+        tmp_file = f"{converted_file}.{os.getpid()}.tmp"
+        shutil.copyfile(input_file, tmp_file)
+        swapped = np.memmap(tmp_file, dtype=">f4", mode="r+")
+        swapped.byteswap(inplace=True)
+        swapped.flush()
+        del swapped
+        os.replace(tmp_file, converted_file)
+
+    data = np.memmap(converted_file, dtype=np.float32, mode='r', shape=shape)
+
+    # 体素数远小于 2^31，排列以 int32 保存，常驻内存减半
+    sort_order = np.argsort(data, axis=None).astype(np.int32)
+    sorted_values = data.ravel()[sort_order]
+    sort_order.flags.writeable = False
+    sorted_values.flags.writeable = False
+    return data, sorted_values, sort_order
+
+# 启动时加载体数据并建立值域索引；失败立即抛出，避免服务在错误状态下对外提供接口
+VOLUME, SORTED_VALUES, SORT_ORDER = load_volume(input_file, (n3, n2, n1))
+
+# ===== 颜色映射查找表 =====
+# 亮度系数：整体乘以该系数，数值越小画面越暗，细节层次更明显
+BRIGHTNESS_FACTOR = 0.8
+
+
+# 支持的颜色映射名称：grayscale 为线性灰度，其余取自 matplotlib
+COLORMAP_NAMES = ('grayscale', 'magma', 'coolwarm', 'plasma', 'viridis', 'inferno', 'cividis', 'turbo', 'jet')
+
+
+def build_colormap_lut(colormap_name):
+    """
+    生成 256 级 RGB 查找表（uint8，shape=(256, 3)），亮度系数已计入。
+    - grayscale：R=G=B 线性灰度
+    - 其他：matplotlib 注册的 colormap
+    """
+    if colormap_name == 'grayscale':
+        levels = np.arange(256, dtype=np.uint8)
+        lut = np.repeat(levels[:, None], 3, axis=1)
+    else:
+        rgba = colormaps[colormap_name](np.linspace(0.0, 1.0, 256))  # shape: (256, 4)
+        lut = (rgba[:, :3] * 255).astype(np.uint8)
+    return (lut * BRIGHTNESS_FACTOR).astype(np.uint8)
+
+
+# 启动时预先生成全部查找表，请求时只做字典查找
+COLORMAP_LUTS = {name: build_colormap_lut(name) for name in COLORMAP_NAMES}
+
+
+# PLY 顶点结构：x/y/z 为 float32，颜色通道为 uint8；无填充，与 PLY 二进制正文逐字节一致
+VERTEX_DTYPE = np.dtype([
+    ('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+    ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')
+])
+
+@njit(parallel=True, cache=True)
+def extract_and_color(flat_index, values, shape, spacing, origin, scalar_min, scale, lut, vertices):
+    """
+    单次并行遍历命中体素：由展平下标计算物理坐标，同时将标量归一化、量化为查表下标并取色，
+    结果直接写入 PLY 顶点结构数组 vertices（VERTEX_DTYPE，长度与 flat_index 相同）。
+    坐标 = 原点 + 索引 × 间距；下标 = clip((value - scalar_min) × scale, 0, 255)。
+    """
+    n_points = flat_index.shape[0]
+    ny, nx = shape[1], shape[2]
+    for i in prange(n_points):
+        # 展平下标 -> (z, y, x) 索引
+        f = flat_index[i]
+        ix = f % nx
+        iy = (f // nx) % ny
+        iz = f // (nx * ny)
+        vertex = vertices[i]
+        vertex['x'] = ix * spacing[0] + origin[0]
+        vertex['y'] = iy * spacing[1] + origin[1]
+        vertex['z'] = iz * spacing[2] + origin[2]
+
+        level = (values[i] - scalar_min) * scale
+        if level < 0:
+            level = 0
+        elif level > 255:
+            level = 255
+        k = int(level)
+        vertex['red'] = lut[k, 0]
+        vertex['green'] = lut[k, 1]
+        vertex['blue'] = lut[k, 2]
+
+def ply_header(n_vertices):
+    """生成二进制小端 PLY 文件头（顶点属性：x/y/z float32 + red/green/blue uint8）。"""
+    return (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        f"element vertex {n_vertices}\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        "property uchar red\n"
+        "property uchar green\n"
+        "property uchar blue\n"
+        "end_header\n"
+    ).encode('ascii')
+
 @app.route('/')
 def index():
     """健康检查与提示信息。"""
@@ -70,8 +196,8 @@ def generate_ply():
         - 失败：400/500 + 文本错误说明
 
     备注：
-        - 颜色映射使用 matplotlib.cm；灰度模式为手动线性映射。
-        - 亮度通过 brightness_factor 调整，避免过曝。
+        - 颜色映射通过启动时预生成的 COLORMAP_LUTS 查表完成，仅支持 COLORMAP_NAMES 中的名称。
+        - 亮度通过 BRIGHTNESS_FACTOR 调整，避免过曝。
     """
     # ===== 1) 读取请求参数 =====
     data = request.get_json()
@@ -79,137 +205,75 @@ def generate_ply():
     max_val = data.get('max_val')
     colormap_name = data.get('colormap', 'grayscale')
 
-    # 调试输出：便于在服务端日志中追踪调用参数
-    print(f'max_val={max_val}, min_val={min_val}, colormap={colormap_name}')
-
     # 基本参数校验：检查数值类型与范围关系
     if not isinstance(min_val, (int, float)) or not isinstance(max_val, (int, float)):
         return Response('无效的 min_val 或 max_val 参数，必须为数值', status=400)
     if min_val >= max_val:
         return Response('min_val 必须小于 max_val', status=400)
 
-    # ===== 2) 数据体维度与文件路径配置 =====
-    input_file = os.path.join(current_dir, 'Saltf')  # Saltf 文件路径（与脚本同目录）
-    n1, n2, n3 = 210, 676, 676                       # 体素维度（X, Y, Z）
-    spacing = (20.0, 20.0, 20.0)                     # 各轴方向物理间距（单位：同源数据单位，示例 mm）
-    origin = (0.0, 0.0, 0.0)                         # 原点坐标（用于生成物理坐标）
+    # 颜色映射查找表（已包含亮度调整）；名称不在支持列表中直接拒绝
+    lut = COLORMAP_LUTS.get(colormap_name)
+    if lut is None:
+        return Response(
+            f"无效的 colormap 参数: {colormap_name}，支持 {', '.join(COLORMAP_NAMES)}",
+            status=400
+        )
 
-    # ===== 3) 读取并重构 Saltf 数据 =====
-    try:
-        # 按大端 float32（>f4）直接读取为一维数组
-        data = np.fromfile(input_file, dtype=">f4")
-        expected_size = n1 * n2 * n3
-        if len(data) != expected_size:
-            # 文件体素数与期望不一致，通常表示源数据尺寸或 dtype 配置错误
-            return Response(f"预期数据点数 {expected_size}，实际得到 {len(data)}", status=500)
-
-        # 重塑为三维数组并转为小端 float32（提升后续 numpy 操作兼容性/性能）
-        data = data.reshape((n3, n2, n1))
-        data = data.byteswap().view(np.float32)
-    except Exception as e:
-        # 捕获文件读取与 reshape 过程中的异常
-        return Response(f"读取文件失败: {str(e)}", status=500)
-
-    # ===== 4) 生成三维物理坐标网格 =====
-    # np.linspace 生成等间隔物理坐标；长度等于对应轴体素数
-    x = np.linspace(origin[0], origin[0] + spacing[0] * (n1 - 1), n1)
-    y = np.linspace(origin[1], origin[1] + spacing[1] * (n2 - 1), n2)
-    z = np.linspace(origin[2], origin[2] + spacing[2] * (n3 - 1), n3)
-    # indexing='ij' 确保 X/Y/Z 轴顺序对应 (X->n1, Y->n2, Z->n3)
-    X, Y, Z = np.meshgrid(x, y, z, indexing='ij')
-
-    # 将坐标网格与体素值展平为一维，便于向量化筛选
-    X_flat = X.flatten()
-    Y_flat = Y.flatten()
-    Z_flat = Z.flatten()
-    values_flat = data.flatten()
-
-    # ===== 5) 阈值筛选体素点 =====
-    mask = (values_flat >= min_val) & (values_flat <= max_val)
-    x_vals = X_flat[mask]
-    y_vals = Y_flat[mask]
-    z_vals = Z_flat[mask]
-    values_vals = values_flat[mask]
-
-    # ===== 6) 归一化与颜色映射 =====
-    # 注意：若 values_vals 为空，values_vals.min()/max() 将报错。
-    scalar_min = values_vals.min()
-    scalar_max = values_vals.max()
-    scalar_range = scalar_max - scalar_min
-    if scalar_range == 0:
-        normalized = np.zeros_like(values_vals)
-    else:
-        normalized = (values_vals - scalar_min) / scalar_range
+    # ===== 2-3) 体数据与值域索引已在启动时加载（VOLUME / SORTED_VALUES / SORT_ORDER） =====
 
-    # 选择颜色映射方案：
-    # - grayscale：手动将 normalized 映射到 [0,255] 的灰度，R=G=B
-    # - 其他：使用 matplotlib.cm.get_cmap(colormap_name)，返回 RGBA（取前三通道）
-    if colormap_name == 'grayscale':
-        r = g = b = (normalized * 255).astype(np.uint8)
-    else:
-        try:
-            colormap = cm.get_cmap(colormap_name)         # e.g. 'magma', 'coolwarm', 'plasma', ...
-            rgba_colors = colormap(normalized)            # shape: (N, 4)
-            r = (rgba_colors[:, 0] * 255).astype(np.uint8)
-            g = (rgba_colors[:, 1] * 255).astype(np.uint8)
-            b = (rgba_colors[:, 2] * 255).astype(np.uint8)
-        except ValueError:
-            # colormap 名称无效时给出提示
-            return Response(
-                f"无效的 colormap 参数: {colormap_name}，支持 'grayscale', 'magma', 'coolwarm', 'plasma' 等",
-                status=400
-            )
-
-    # 亮度调整：整体乘以 brightness_factor，数值越小画面越暗，细节层次更明显
-    brightness_factor = 0.8
-    r = (r * brightness_factor).astype(np.uint8)
-    g = (g * brightness_factor).astype(np.uint8)
-    b = (b * brightness_factor).astype(np.uint8)
-
-    # ===== 7) 组织 PLY 顶点数据（带 RGB） =====
-    # 结构化 dtype：x/y/z 为 float32，颜色通道为 uint8
-    vertices = np.zeros(
-        len(x_vals),
-        dtype=[
-            ('x', 'f4'), ('y', 'f4'), ('z', 'f4'),
-            ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')
-        ]
-    )
-    vertices['x'] = x_vals
-    vertices['y'] = y_vals
-    vertices['z'] = z_vals
-    vertices['red'] = r
-    vertices['green'] = g
-    vertices['blue'] = b
-
-    # PLY 顶点元素与数据对象（text=False -> 二进制；byte_order='<' -> 小端）
-    element = PlyElement.describe(vertices, 'vertex')
-    ply_data = PlyData([element], text=False, byte_order='<')
-
-    # 调试信息：元素数量与样例点打印
-    print(f"PLY 数据元素数: {ply_data.__len__()}")
-    print(f"筛选后的点数，范围 [{min_val}, {max_val}]: {len(x_vals)}")
-    print("前 20 个点的坐标和强度值 (x, y, z, intensity):")
-    for i in range(min(20, len(x_vals))):
-        print(f"点 {i}: x={x_vals[i]:.2f}, y={y_vals[i]:.2f}, z={z_vals[i]:.2f}, intensity={values_vals[i]:.2f}")
-
-    # 逻辑提示：此处才判断“无点”会晚于 min/max，若为空会在更早处抛错
-    # *保持原逻辑*，不调整顺序
-    if len(x_vals) == 0:
-        print("在指定范围内未找到点。")
+    # ===== 4) 阈值筛选体素点 =====
+    # 在有序值数组上二分查找区间边界，命中体素即排列数组的连续切片，无需全量掩码扫描；
+    # 阈值先转 float32：与体素同精度比较（边界含端点，与 VTP/VTI 一致），且避免 searchsorted 将整卷提升为 float64
+    lo = np.searchsorted(SORTED_VALUES, np.float32(min_val), side='left')
+    hi = np.searchsorted(SORTED_VALUES, np.float32(max_val), side='right')
+    flat_index = SORT_ORDER[lo:hi]
+    values_vals = SORTED_VALUES[lo:hi]
+
+    # 无命中点（含区间整体落在全局值域 [SORTED_VALUES[0], SORTED_VALUES[-1]] 之外）时立即返回
+    if hi == lo:
         return Response(f"在范围 [{min_val}, {max_val}] 内未找到点", status=400)
 
-    # ===== 8) 写入内存并返回为附件下载 =====
-    output = BytesIO()
-    ply_data.write(output)
-    output.seek(0)
-
-    return send_file(
-        output,
-        mimetype='application/octet-stream',
-        as_attachment=True,
-        download_name='pointcloud.ply'
-    )
+    # ===== 5) 归一化参数：标量值域与量化比例 =====
+    # values_vals 为非空有序切片，首尾即最小/最大值
+    scalar_min = values_vals[0]
+    scalar_max = values_vals[-1]
+    scalar_range = scalar_max - scalar_min
+    scale = np.float32(255.0 / scalar_range) if scalar_range > 0 else np.float32(0.0)
+
+    # ===== 6) 组织 PLY 顶点数据（带 RGB） =====
+    # 坐标计算 + 归一化取色单次融合遍历，直接写入结构化顶点数组，不再经中间 xyz/rgb 数组逐字段拷贝
+    vertices = np.empty(len(flat_index), dtype=VERTEX_DTYPE)
+    extract_and_color(flat_index, values_vals, VOLUME.shape, spacing, origin, scalar_min, scale, lut, vertices)
+
+    # ===== 7) 写入临时文件并返回为附件下载 =====
+    # 顶点为无填充的小端结构化数组，二进制 PLY 正文即其原始字节，文件头后由 tofile 直接写出；
+    # 以文件路径交给 send_file 分块读出发送，无需在内存中再缓存一份响应
+    ply_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix='.ply', delete=False) as tf:
+            ply_path = tf.name
+            tf.write(ply_header(len(vertices)))
+            vertices.tofile(tf)
+        response = send_file(
+            ply_path,
+            mimetype='application/octet-stream',
+            as_attachment=True,
+            download_name='pointcloud.ply'
+        )
+    except Exception:
+        # 写出或构造响应失败：删除已创建的临时文件后继续抛出
+        if ply_path is not None:
+            try:
+                os.remove(ply_path)
+            except OSError:
+                pass
+        raise
+
+    # 响应关闭时（werkzeug 已关闭文件句柄之后）再删除临时文件，Windows 下也能删除，不残留；
+    # direct_passthrough 下 werkzeug 直接交出文件迭代器、不会调用 call_on_close 注册的回调，故需关闭
+    response.direct_passthrough = False
+    response.call_on_close(lambda: os.remove(ply_path))
+    return response
 
 if __name__ == '__main__':
     # 开发模式启动：监听 0.0.0.0:5000，并开启调试
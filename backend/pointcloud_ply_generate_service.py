@@ -7,34 +7,127 @@
 主要功能：
     1. 接收前端 POST 请求，包含 min_val / max_val（筛选阈值范围）。
     2. 读取 Saltf 文件（大端浮点数格式），重构为三维体数据。
-    3. 生成对应的三维坐标网格，与体素值一一对应。
-    4. 按阈值范围筛选符合条件的点，构建 PLY 格式点云。
-    5. 将点云文件通过 HTTP 以附件形式返回给前端。
+    3. 按阈值范围筛选符合条件的体素，仅对命中体素由索引计算三维坐标（numba 并行）。
+    4. 构建 PLY 格式点云：ASCII 文件头 + 顶点结构化数组原始字节（二进制小端）。
+    5. 将点云写入临时文件，通过 HTTP 以附件形式返回给前端，响应关闭后删除。
     6. 支持 CORS 跨域请求。
 
 依赖：
     - Flask：Web 框架
     - flask_cors：跨域支持
     - numpy：数值运算
-    - plyfile：生成 PLY 文件
+    - numba：并行计算坐标
     - Python 3.x
 
 运行条件：
     - 本地必须存在 Saltf 文件（大端 float32 格式）。
     - Python 环境已安装上述依赖包。
+    - 启动时加载体数据（首次启动生成小端副本 Saltf.f32，需目录可写），文件缺失或尺寸不符时启动即失败。
     - 服务运行在 0.0.0.0:5000，默认开启 debug 模式。
 """
 
 from flask import Flask, request, Response, send_file
-from io import BytesIO
+import tempfile
+import os
+import shutil
 import numpy as np
-from plyfile import PlyData, PlyElement
+from numba import njit, prange
 from flask_cors import CORS
 
 # 初始化 Flask 应用，并开启 CORS（允许跨域请求）
 app = Flask(__name__)
 CORS(app)
 
+# PLY 顶点布局：x/y/z/scalar 均为小端 float32，无填充，与 extract_points 的 (K, 4) 行布局逐字节一致
+VERTEX_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('scalar', '<f4')])
+
+# ===== 配置点云数据文件与维度信息 =====
+input_file = "Saltf"                # 输入文件路径
+n1, n2, n3 = 210, 676, 676          # 数据体素维度（X, Y, Z）
+spacing = (20.0, 20.0, 20.0)        # 各轴方向点间距 (mm)
+origin = (0.0, 0.0, 0.0)            # 原点坐标
+
+# 体数据加载：启动时内存映射一次，避免每次请求重复读盘
+def load_volume(input_file, shape):
+    """
+    以只读内存映射方式加载 Saltf 体数据，返回本机小端 float32 三维数组 (Z, Y, X)，仅在启动时调用一次。
+    Saltf 为大端 float32：首次启动（或 Saltf 更新后）一次性转换为同目录下的小端副本（<input_file>.f32），
+    之后直接 np.memmap 映射该副本，由操作系统按需换页、在多个进程间共享页缓存，
+    请求无需再读取整个文件或交换字节序。
+    同时建立值域索引：按体素值排序后的值数组及其对应的展平下标（argsort 排列，int32），
+    请求时用两次 searchsorted 即可定位阈值区间内的全部体素。
+    文件体素数与 shape 不一致时抛出 ValueError。
+
+    返回：(data, sorted_values, sort_order)
+    """
+    expected_size = int(np.prod(shape))
+    actual_size = os.path.getsize(input_file) // 4
+    if actual_size != expected_size:
+        raise ValueError(f"预期数据点数 {expected_size}，实际得到 {actual_size}")
+
+    converted_file = input_file + '.f32'
+    if not os.path.exists(converted_file) or os.path.getmtime(converted_file) < os.path.getmtime(input_file):
+        # 复制后在可写内存映射上原地转小端，不经 Python 堆；先写临时文件再原子替换，避免并发进程读到半成品
+        tmp_file = f"{converted_file}.{os.getpid()}.tmp"
+        shutil.copyfile(input_file, tmp_file)
+        swapped = np.memmap(tmp_file, dtype=">f4", mode="r+")
+        swapped.byteswap(inplace=True)
+        swapped.flush()
+        del swapped
+        os.replace(tmp_file, converted_file)
+
+    data = np.memmap(converted_file, dtype=np.float32, mode='r', shape=shape)
+
+    # 体素数远小于 2^31，排列以 int32 保存，常驻内存减半
+    sort_order = np.argsort(data, axis=None).astype(np.int32)
+    sorted_values = data.ravel()[sort_order]
+    sort_order.flags.writeable = False
+    sorted_values.flags.writeable = False
+    return data, sorted_values, sort_order
+
+
+# 启动时加载体数据并建立值域索引；失败立即抛出，避免服务在错误状态下对外提供接口
+VOLUME, SORTED_VALUES, SORT_ORDER = load_volume(input_file, (n3, n2, n1))
+
+
+@njit(parallel=True, cache=True)
+def extract_points(flat_index, values, shape, spacing, origin):
+    """
+    并行遍历命中体素：由展平下标计算物理坐标，并与标量值一起写入同一行。
+    坐标 = 原点 + 索引 × 间距；各点写入互不重叠的行，无需同步。
+
+    返回：float32[K, 4]，每行为 (x, y, z, scalar)
+    """
+    n_points = flat_index.shape[0]
+    ny, nx = shape[1], shape[2]
+    out = np.empty((n_points, 4), dtype=np.float32)
+    for i in prange(n_points):
+        # 展平下标 -> (z, y, x) 索引
+        f = flat_index[i]
+        ix = f % nx
+        iy = (f // nx) % ny
+        iz = f // (nx * ny)
+        out[i, 0] = ix * spacing[0] + origin[0]
+        out[i, 1] = iy * spacing[1] + origin[1]
+        out[i, 2] = iz * spacing[2] + origin[2]
+        out[i, 3] = values[i]
+    return out
+
+
+def ply_header(n_vertices):
+    """生成二进制小端 PLY 文件头（顶点属性：x/y/z/scalar float32）。"""
+    return (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        f"element vertex {n_vertices}\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        "property float scalar\n"
+        "end_header\n"
+    ).encode('ascii')
+
+
 @app.route('/generate-ply', methods=['POST'])
 def generate_ply():
     """
@@ -57,90 +150,63 @@ def generate_ply():
     min_val = data.get('min_val')
     max_val = data.get('max_val')
 
-    # 调试输出请求参数
-    print(f"max_val = {max_val}")
-    print(f"min_val = {min_val}")
-
     # 参数校验：必须是数值类型，且 min_val < max_val
     if not isinstance(min_val, (int, float)) or not isinstance(max_val, (int, float)):
         return Response('无效的 min_val 或 max_val 参数，必须为数值', status=400)
     if min_val >= max_val:
         return Response('min_val 必须小于 max_val', status=400)
 
-    # ===== 配置点云数据文件与维度信息 =====
-    input_file = "Saltf"                # 输入文件路径
-    n1, n2, n3 = 210, 676, 676          # 数据体素维度（X, Y, Z）
-    spacing = (20.0, 20.0, 20.0)        # 各轴方向点间距 (mm)
-    origin = (0.0, 0.0, 0.0)            # 原点坐标
+    # ===== Step1: 体数据与值域索引已在启动时加载（VOLUME / SORTED_VALUES / SORT_ORDER） =====
 
-    # ===== Step1: 读取 Saltf 文件 =====
-    try:
-        # 从文件读取大端浮点数 (>f4)，返回 1D 数组
-        data = np.fromfile(input_file, dtype=">f4")
-        expected_size = n1 * n2 * n3
-        if len(data) != expected_size:
-            return Response(f"预期数据点数 {expected_size}，实际得到 {len(data)}", status=500)
-        # 重塑为 3D 数组 (Z, Y, X)，并转为小端 float32
-        data = data.reshape((n3, n2, n1))
-        data = data.byteswap().view(np.float32)
-    except Exception as e:
-        return Response(f"读取文件失败: {str(e)}", status=500)
-
-    # ===== Step2: 生成 3D 坐标网格 =====
-    # np.linspace 生成等间距坐标，长度等于对应轴上的点数
-    x = np.linspace(origin[0], origin[0] + spacing[0] * (n1 - 1), n1)
-    y = np.linspace(origin[1], origin[1] + spacing[1] * (n2 - 1), n2)
-    z = np.linspace(origin[2], origin[2] + spacing[2] * (n3 - 1), n3)
-    # meshgrid 生成坐标网格（indexing='ij' 确保 X/Y/Z 维度对应）
-    X, Y, Z = np.meshgrid(x, y, z, indexing='ij')
-
-    # ===== Step3: 展平坐标和体素值 =====
-    X_flat, Y_flat, Z_flat = X.flatten(), Y.flatten(), Z.flatten()
-    values_flat = data.flatten()
-
-    # ===== Step4: 按阈值范围筛选点 =====
-    mask = (values_flat >= min_val) & (values_flat <= max_val)
-    x_vals = X_flat[mask]
-    y_vals = Y_flat[mask]
-    z_vals = Z_flat[mask]
-    values_vals = values_flat[mask]
-
-    # ===== Step5: 构造 PLY 数据 =====
-    # 顶点结构包含 x/y/z 三维坐标及 scalar 强度值
-    vertices = np.zeros(
-        len(x_vals),
-        dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4'), ('scalar', 'f4')]
-    )
-    vertices['x'] = x_vals
-    vertices['y'] = y_vals
-    vertices['z'] = z_vals
-    vertices['scalar'] = values_vals
-
-    # 描述顶点元素，并封装为 PLY 数据对象（小端二进制）
-    element = PlyElement.describe(vertices, 'vertex')
-    ply_data = PlyData([element], text=False, byte_order='<')
-
-    # 调试输出：点数量
-    print(f"筛选后的点数：{len(x_vals)}")
-    # 调试输出：前 20 个点信息
-    for i in range(min(20, len(x_vals))):
-        print(f"点 {i}: x={x_vals[i]:.2f}, y={y_vals[i]:.2f}, z={z_vals[i]:.2f}, intensity={values_vals[i]:.2f}")
-
-    # 若没有符合条件的点，直接返回错误
-    if len(x_vals) == 0:
+    # ===== Step2: 按阈值范围筛选点 =====
+    # 在有序值数组上二分查找区间边界，命中体素即排列数组的连续切片，无需全量掩码扫描；
+    # 阈值先转 float32：与体素同精度比较（边界含端点，与 VTP/VTI 一致），且避免 searchsorted 将整卷提升为 float64
+    lo = np.searchsorted(SORTED_VALUES, np.float32(min_val), side='left')
+    hi = np.searchsorted(SORTED_VALUES, np.float32(max_val), side='right')
+    flat_index = SORT_ORDER[lo:hi]
+    values_vals = SORTED_VALUES[lo:hi]
+
+    # 若没有符合条件的点（含区间整体落在全局值域之外），直接返回错误，跳过后续计算
+    if hi == lo:
         return Response(f"在范围 [{min_val}, {max_val}] 内未找到点", status=400)
 
-    # ===== Step6: 写入内存流并返回 =====
-    output = BytesIO()
-    ply_data.write(output)
-    output.seek(0)
-
-    return send_file(
-        output,
-        mimetype='application/octet-stream',
-        as_attachment=True,
-        download_name='pointcloud.ply'
-    )
+    # ===== Step3: 由体素索引计算物理坐标（numba 并行） =====
+    # 坐标 = 原点 + 索引 × 间距，全程 float32，仅对命中点计算
+    points = extract_points(flat_index, values_vals, VOLUME.shape, spacing, origin)
+
+    # ===== Step4: 构造 PLY 数据 =====
+    # 顶点结构包含 x/y/z 三维坐标及 scalar 强度值；与 (K, 4) float32 行布局一致，直接视图复用
+    vertices = points.view(VERTEX_DTYPE).reshape(-1)
+
+    # ===== Step5: 写入临时文件并返回 =====
+    # 二进制 PLY 正文即顶点数组的原始字节，文件头后由 tofile 一次写出，无需逐元素序列化；
+    # 以文件路径交给 send_file 分块读出发送，无需在内存中再缓存一份响应
+    ply_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix='.ply', delete=False) as tf:
+            ply_path = tf.name
+            tf.write(ply_header(len(vertices)))
+            vertices.tofile(tf)
+        response = send_file(
+            ply_path,
+            mimetype='application/octet-stream',
+            as_attachment=True,
+            download_name='pointcloud.ply'
+        )
+    except Exception:
+        # 写出或构造响应失败：删除已创建的临时文件后继续抛出
+        if ply_path is not None:
+            try:
+                os.remove(ply_path)
+            except OSError:
+                pass
+        raise
+
+    # 响应关闭时（werkzeug 已关闭文件句柄之后）再删除临时文件，Windows 下也能删除，不残留；
+    # direct_passthrough 下 werkzeug 直接交出文件迭代器、不会调用 call_on_close 注册的回调，故需关闭
+    response.direct_passthrough = False
+    response.call_on_close(lambda: os.remove(ply_path))
+    return response
 
 if __name__ == '__main__':
     """
@@ -10,33 +10,41 @@
 
 特点与优化点：
     1) VTP 直接在内存中生成，不落盘，减少 IO。
-    2) 使用 NumPy 一次性批量构造 Verts（[1, pointId] 重复数组），避免循环，提升性能。
+    2) Verts 以 (offsets, connectivity) int32 数组构造，复用缓存的递增序列，避免循环与交错拷贝。
+       vtkPolyData / 数组 / Writer 启动时预构建，请求间只替换底层缓冲区。
     3) 全链路耗时统计：参数校验 / 数据筛选 / VTP 生成 / 压缩 / 总耗时。
     4) 文件大小统计：压缩前/压缩后大小与压缩率，便于观测体量。
-    5) 启动阶段将体数据与坐标网格展平缓存到内存（X_FLAT/Y_FLAT/Z_FLAT/VALUES_FLAT），
-       请求时仅做掩码筛选与拼装，响应更快。
+    5) 启动阶段将 Saltf 一次性转换为小端副本（Saltf.f32）并只读内存映射为 VOLUME，不预先展开坐标网格；
+       启动时一次性按值排序建立索引（SORTED_VALUES / SORT_ORDER），请求时二分查找命中区间，
+       并只为命中体素由索引计算坐标，响应更快、内存更省。
+    6) 按阈值区间（float32 阈值，即筛选实际使用的精度）LRU 缓存压缩后的 VTP，重复区间直接返回；
+       未命中时边压缩边分块发送，首字节无需等待整份压缩完成。
 
 依赖：
     - Flask, flask_cors
     - numpy
-    - vtk (vtkPython)、vtkmodules.util.numpy_support
+    - vtk (vtkPython)
     - gzip
     - Python 3.x
 
 输入/输出与数据流：
     启动时：
-        Saltf(>f4) -> np.fromfile -> reshape(Z,Y,X) -> byteswap().view(float32)
-        -> 生成 X/Y/Z 网格 -> flatten -> 缓存全局一维数组
+        Saltf(>f4) -> （首次）复制并原地 byteswap -> Saltf.f32 -> np.memmap(float32, 只读, Z×Y×X)
+        -> 全局三维数组 VOLUME -> argsort 建立值域索引 SORTED_VALUES / SORT_ORDER（首尾即 GLOBAL_MIN / GLOBAL_MAX）
     请求 /generate-vtp：
-        JSON(min_val, max_val) -> 掩码筛选 (VALUES_FLAT)
+        JSON(min_val, max_val) -> searchsorted 定位命中区间 -> 展平下标 divmod 换算坐标（N×3 float32）
         -> create_vtp_bytes_with_verts(...) 组装 vtkPolyData + 二进制写出 VTP
-        -> gzip 压缩 -> HTTP 返回 application/gzip
+        -> gzip 分段压缩并分块发送 application/vnd.vtp+xml + Content-Encoding: gzip（发送完成后按区间写入 LRU 缓存）
 
 注意事项：
     - dims / spacing / origin 要与真实数据一致，否则坐标与体素对应会错位。
-    - VTK 的 CellArray 采用 [npts, id0, npts, id1, ...] 紧凑存储；此处 npts=1（Verts）。
+    - 点坐标由 (Z, Y, X) 体数据的展平下标计算（x 变化最快），与 VTI / PLY 服务的体素-坐标对应一致。
+      旧版以 indexing="ij" 的 (X, Y, Z) 网格对应 (Z, Y, X) 体数据，轴序不一致；因此所有点位置相对旧版均有变化。
+    - VTK 的 CellArray 采用 offsets + connectivity 存储；此处每个单元 1 个点（Verts）。
     - 大数据集（210×676×676）非常大，内存与 CPU 压力较高；生产环境需考虑分块与缓存策略。
-    - 若筛选后点数为 0，会直接 400 返回“范围内无数据”。
+    - 响应为 gzip 传输编码（Content-Encoding: gzip）的 VTP；若前置 nginx 等反向代理，可改由代理压缩
+      （gzip_types application/vnd.vtp+xml），服务端去掉 gzip_frames 直接返回原始 VTP 即可。
+    - 若区间与全局值域不相交或筛选后点数为 0，会直接 400 返回“范围内无数据”。
 
 日志：
     - 启动日志写入 log/pointcloud_with_verts.log
@@ -48,13 +56,15 @@ import datetime
 from flask import jsonify
 from flask_cors import CORS
 import os
+import shutil
 import time
 import logging
 import gzip
+import threading
+from collections import OrderedDict
 from io import BytesIO
 import numpy as np
-from vtk import vtkPolyData, vtkPoints, vtkXMLPolyDataWriter, vtkCellArray
-from vtkmodules.util import numpy_support
+from vtk import vtkPolyData, vtkPoints, vtkXMLPolyDataWriter, vtkCellArray, vtkFloatArray, vtkIntArray
 
 # ----------------------------
 # Flask 初始化与配置
@@ -85,91 +95,150 @@ input_file = "Saltf"          # 输入文件名（大端浮点数，>f4）
 try:
     init_start = time.time()
 
-    # 1) 读取大端浮点数；返回一维数组
-    raw_data = np.fromfile(input_file, dtype=">f4")
+    # 1) 按文件大小校验体素数（无需读入数据）
     expected_size = np.prod(dims)
-    if len(raw_data) != expected_size:
+    actual_size = os.path.getsize(input_file) // 4
+    if actual_size != expected_size:
         # 维度不匹配通常表示 dims 配置或原始文件错误
-        raise ValueError(f"预期数据量 {expected_size}，实际 {len(raw_data)}")
-
-    # 2) 转小端 + reshape 为 (Z, Y, X)，与 vtk 常见坐标顺序保持一致
-    raw_data = raw_data.reshape((dims[2], dims[1], dims[0])).byteswap().view(np.float32)
-
-    # 3) 生成物理坐标网格（等间距）
-    x = np.linspace(origin[0], origin[0] + spacing[0] * (dims[0] - 1), dims[0])
-    y = np.linspace(origin[1], origin[1] + spacing[1] * (dims[1] - 1), dims[1])
-    z = np.linspace(origin[2], origin[2] + spacing[2] * (dims[2] - 1), dims[2])
-    # indexing="ij" 确保 (i->X, j->Y, k->Z) 的轴语义不被交换
-    X, Y, Z = np.meshgrid(x, y, z, indexing="ij")
-
-    # 4) 展平成一维数组，后续筛选直接用掩码（无需重复构造网格）
-    X_FLAT = X.flatten()
-    Y_FLAT = Y.flatten()
-    Z_FLAT = Z.flatten()
-    VALUES_FLAT = raw_data.flatten()
-
-    logging.info(f"初始化完成，数据加载耗时 {time.time() - init_start:.3f} 秒")
+        raise ValueError(f"预期数据量 {expected_size}，实际 {actual_size}")
+
+    # 2) 首次启动（或 Saltf 更新后）生成小端副本 <input_file>.f32：复制后在可写内存映射上原地转小端，
+    #    不经 Python 堆；先写临时文件再原子替换，避免并发进程读到半成品
+    converted_file = input_file + ".f32"
+    if not os.path.exists(converted_file) or os.path.getmtime(converted_file) < os.path.getmtime(input_file):
+        tmp_file = f"{converted_file}.{os.getpid()}.tmp"
+        shutil.copyfile(input_file, tmp_file)
+        swapped = np.memmap(tmp_file, dtype=">f4", mode="r+")
+        swapped.byteswap(inplace=True)
+        swapped.flush()
+        del swapped
+        os.replace(tmp_file, converted_file)
+
+    # 3) 只读内存映射为 (Z, Y, X)，与 vtk 常见坐标顺序保持一致；页缓存由多个 worker 进程共享。
+    #    坐标不再预先展开为网格，请求时只为命中体素计算
+    VOLUME = np.memmap(converted_file, dtype=np.float32, mode="r", shape=(dims[2], dims[1], dims[0]))
+
+    # 4) 值域索引：体素值升序排列及对应的展平下标，一次性排序，
+    #    请求时两次 searchsorted 即得命中区间，无需整卷布尔扫描；
+    #    体素数远小于 2^31，排列以 int32 保存，常驻内存减半
+    SORT_ORDER = np.argsort(VOLUME, axis=None).astype(np.int32)
+    SORTED_VALUES = VOLUME.ravel()[SORT_ORDER]
+
+    # 5) 全局值域（Python 标量），请求区间与之不相交时直接判定无数据
+    GLOBAL_MIN = float(SORTED_VALUES[0])
+    GLOBAL_MAX = float(SORTED_VALUES[-1])
+
+    logging.info("初始化完成，数据加载耗时 %.3f 秒", time.time() - init_start)
 except Exception as e:
     # 初始化失败立即抛出，避免服务在错误状态下对外提供接口
-    logging.error(f"初始化失败: {e}", exc_info=True)
+    logging.error("初始化失败: %s", e, exc_info=True)
     raise
 
+# ----------------------------
+# Verts 下标缓存：递增 int32 序列，按需倍增，各请求只读共享其前缀
+# ----------------------------
+VERT_IDS = np.arange(0, dtype=np.int32)
+
+def vert_ids(n_points):
+    """
+    返回长度至少为 n_points + 1 的递增 int32 下标序列（0, 1, 2, ...）。
+    按倍增扩容，但不超过全卷体素数 + 1（单次请求的点数上限），避免全命中区间时倍增到近两倍体量。
+    """
+    global VERT_IDS
+    ids = VERT_IDS
+    if len(ids) < n_points + 1:
+        ids = np.arange(min(max(n_points + 1, 2 * len(ids)), VOLUME.size + 1), dtype=np.int32)
+        VERT_IDS = ids
+    return ids
+
+# ----------------------------
+# VTK 对象预构建：PolyData / 数组 / Writer 启动时建好，请求间复用
+# 每次请求只把本次的 numpy 缓冲区以 SetVoidArray（save=1，VTK 不接管释放）挂到数组上，
+# 写出后立即解绑；共享对象由 VTP_BUILD_LOCK 串行化
+# ----------------------------
+POINT_COORDS = vtkFloatArray()         # Points 坐标（N×3 float32）
+POINT_COORDS.SetNumberOfComponents(3)
+SCALARS = vtkFloatArray()              # PointData 标量，命名为 ScalarValue，便于前端根据此名取用
+SCALARS.SetName("ScalarValue")
+VERT_OFFSETS = vtkIntArray()           # Verts offsets（int32）
+VERT_CONNECTIVITY = vtkIntArray()      # Verts connectivity（int32）
+
+POINTS = vtkPoints()
+POINTS.SetData(POINT_COORDS)
+VERTS = vtkCellArray()
+POLYDATA = vtkPolyData()
+POLYDATA.SetPoints(POINTS)
+POLYDATA.GetPointData().SetScalars(SCALARS)
+POLYDATA.SetVerts(VERTS)
+
+VTP_WRITER = vtkXMLPolyDataWriter()
+VTP_WRITER.SetInputData(POLYDATA)
+VTP_WRITER.SetDataModeToBinary()       # 二进制写出，体积更小、解析更快
+VTP_WRITER.WriteToOutputStringOn()     # 写到内存字符串（不落盘）
+VTP_BUILD_LOCK = threading.Lock()
+
 # ----------------------------
 # 工具函数：生成带 Verts 的 VTP 二进制数据
 # ----------------------------
-def create_vtp_bytes_with_verts(x_vals, y_vals, z_vals, scalar_vals):
+def create_vtp_bytes_with_verts(flat_index, scalar_vals):
     """
     生成 VTP（二进制）字节串，包含：
-      - Points：点坐标 (x, y, z)
+      - Points：点坐标 (x, y, z)，由体素展平下标在此处换算
       - PointData：标量 ScalarValue
       - Verts：单点单元（每个单元由一个点构成）
+    复用预构建的 POLYDATA / VTP_WRITER，不再逐请求创建 VTK 对象。
 
     参数：
-        x_vals, y_vals, z_vals : 1D np.ndarray，点坐标（同长度）
-        scalar_vals            : 1D np.ndarray，对应的标量值（同长度）
+        flat_index  : 1D np.ndarray(int32)，命中体素在 VOLUME 中的展平下标
+        scalar_vals : 1D np.ndarray，对应的标量值（同长度）
 
     返回：
         vtp_bytes : bytes，VTK XML PolyData（二进制）内容
     """
 
-    # 1) 构造点坐标（N×3），并转为 VTK 数组
-    # np.c_[...] 以零拷贝/视图方式拼列（视情况），deep=True 确保 VTK 拷贝数据到自身内存
-    points = vtkPoints()
-    points.SetData(numpy_support.numpy_to_vtk(np.c_[x_vals, y_vals, z_vals], deep=True))
-
-    # 2) 标量（PointData 下的数组，命名为 ScalarValue，便于前端根据此名取用）
-    scalars = numpy_support.numpy_to_vtk(scalar_vals, deep=True)
-    scalars.SetName("ScalarValue")
-
-    # 3) 批量创建 Verts（单点单元）
-    # VTK CellArray 的紧凑存储格式为：
-    #   [npts, id0, npts, id1, npts, id2, ...]
-    # 其中 npts=1，id 为点索引。共 2*N 个整型。
-    n_points = len(x_vals)
-    verts_array = np.empty(n_points * 2, dtype=np.int64)
-    verts_array[0::2] = 1  # 每个单元包含 1 个点
-    verts_array[1::2] = np.arange(n_points, dtype=np.int64)
-
-    vtk_verts_array = numpy_support.numpy_to_vtkIdTypeArray(verts_array, deep=True)
-    verts = vtkCellArray()
-    # SetCells(numCells, connectivity)
-    verts.SetCells(n_points, vtk_verts_array)
-
-    # 4) 组装 vtkPolyData
-    polydata = vtkPolyData()
-    polydata.SetPoints(points)
-    polydata.GetPointData().SetScalars(scalars)
-    polydata.SetVerts(verts)
-
-    # 5) 写出为 VTP（二进制）
-    writer = vtkXMLPolyDataWriter()
-    writer.SetInputData(polydata)
-    writer.SetDataModeToBinary()        # 二进制写出，体积更小、解析更快
-    writer.WriteToOutputStringOn()      # 写到内存字符串（不落盘）
-    writer.Write()
-
-    # 6) 提取为 bytes
-    vtp_str = writer.GetOutputString()
+    # 1) 构造点坐标（N×3 float32）
+    # 展平下标经两次 int32 divmod 直接写入坐标列（不生成 x/y/z 或 int64 索引中间数组），
+    # 再按行广播一次完成 坐标 = 原点 + 索引 × 间距；全程 float32 运算，索引远小于 2^24，换算无误差
+    n_points = len(flat_index)
+    _, ny, nx = VOLUME.shape
+    coords = np.empty((n_points, 3), dtype=np.float32)
+    rest, coords[:, 0] = np.divmod(flat_index, nx)
+    coords[:, 2], coords[:, 1] = np.divmod(rest, ny)
+    del rest
+    coords *= np.asarray(spacing, dtype=np.float32)
+    coords += np.asarray(origin, dtype=np.float32)
+    scalar_vals = np.ascontiguousarray(scalar_vals, dtype=np.float32)
+
+    with VTP_BUILD_LOCK:
+        # 2) Verts（单点单元）采用 (offsets, connectivity) 两数组存储：单点单元时 offsets = [0..N]，
+        #    connectivity = [0..N-1]，均为同一递增 int32 序列的前缀
+        ids = vert_ids(n_points)
+
+        # 3) 将坐标、标量与 Verts 缓冲区零拷贝挂到预构建数组上；
+        #    本函数持有这些 numpy 数组直至写出完成，写出后解绑，VTK 不保留悬空指针
+        try:
+            POINT_COORDS.SetVoidArray(coords.reshape(-1), coords.size, 1)
+            SCALARS.SetVoidArray(scalar_vals, n_points, 1)
+            VERT_OFFSETS.SetVoidArray(ids[:n_points + 1], n_points + 1, 1)
+            VERT_CONNECTIVITY.SetVoidArray(ids[:n_points], n_points, 1)
+            VERTS.SetData(VERT_OFFSETS, VERT_CONNECTIVITY)
+            # PolyData 会缓存按上次 Verts 建立的单元随机访问表，点数变化后必须丢弃，否则越界访问
+            POLYDATA.DeleteCells()
+            POINTS.Modified()
+            SCALARS.Modified()
+            POLYDATA.Modified()
+
+            # 4) 写出为 VTP（二进制）
+            VTP_WRITER.Write()
+            vtp_str = VTP_WRITER.GetOutputString()
+        finally:
+            for array in (POINT_COORDS, SCALARS, VERT_OFFSETS, VERT_CONNECTIVITY):
+                array.Initialize()
+            VERTS.Initialize()
+            # writer 会一直保留上次的输出字符串；再写出一次空数据将其换成几百字节，避免请求间常驻整份 VTP
+            VTP_WRITER.Write()
+
+    # 5) 提取为 bytes
     # 不同 VTK 版本返回类型可能不同：bytes/str，做兼容处理
     if isinstance(vtp_str, str):
         vtp_bytes = vtp_str.encode('utf-8', errors='ignore')
@@ -179,22 +248,88 @@ def create_vtp_bytes_with_verts(x_vals, y_vals, z_vals, scalar_vals):
     return vtp_bytes
 
 # ----------------------------
-# 工具函数：gzip 压缩
+# 工具函数：gzip 流式压缩
 # ----------------------------
-def gzip_bytes(data_bytes):
-    """对二进制数据进行 gzip 压缩并返回 bytes。"""
+GZIP_CHUNK_SIZE = 1 << 20        # 每次送入压缩器的原始数据量（1 MB）
+
+def gzip_frames(data_bytes):
+    """
+    对二进制数据进行 gzip 压缩，边压缩边逐段产出压缩后的 bytes（生成器）。
+    以 memoryview 分段送入避免额外拷贝；采用较低压缩级别（1）以缩短 CPU 时间，
+    与 VTI 服务一致（体积略增、耗时约减半）。各段按序拼接即完整的 gzip 数据。
+    """
+    view = memoryview(data_bytes)
     buffer = BytesIO()
-    with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
-        gz.write(data_bytes)
-    buffer.seek(0)
-    return buffer.getvalue()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=1) as gz:
+        for start in range(0, len(view), GZIP_CHUNK_SIZE):
+            gz.write(view[start:start + GZIP_CHUNK_SIZE])
+            frame = buffer.getvalue()
+            if frame:
+                yield frame
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()  # gzip 尾部（CRC 与长度）
+
+# ----------------------------
+# 结果缓存：同一阈值区间直接复用已压缩的 VTP
+# ----------------------------
+VTP_CACHE_SIZE = 32              # 缓存的区间数（每项为一份压缩后的 VTP）
+VTP_CACHE = OrderedDict()        # (min_val, max_val) -> (gz_data, 点数, 压缩前大小)，按最近使用排序
+VTP_CACHE_LOCK = threading.Lock()
+
+def cache_get(key):
+    """取缓存项并标记为最近使用；未命中返回 None。"""
+    with VTP_CACHE_LOCK:
+        entry = VTP_CACHE.get(key)
+        if entry is not None:
+            VTP_CACHE.move_to_end(key)
+        return entry
+
+def cache_put(key, entry):
+    """写入缓存项，超出容量时淘汰最久未使用的项。"""
+    with VTP_CACHE_LOCK:
+        VTP_CACHE[key] = entry
+        VTP_CACHE.move_to_end(key)
+        while len(VTP_CACHE) > VTP_CACHE_SIZE:
+            VTP_CACHE.popitem(last=False)
+
+def build_vtp(min_val, max_val):
+    """
+    生成阈值区间 [min_val, max_val] 对应的 VTP（未压缩）。
+    范围内无数据时返回的 VTP 数据为 None。
+
+    返回：
+        (vtp_bytes, 点数, 筛选耗时, VTP 生成耗时)
+    """
+    # ===== B. 数据筛选（有序值二分查找） =====
+    t1 = time.time()
+    # 命中体素即排列数组的连续切片 [lo, hi)；坐标由 create_vtp_bytes_with_verts 按展平下标换算
+    lo = np.searchsorted(SORTED_VALUES, np.float32(min_val), side="left")
+    hi = np.searchsorted(SORTED_VALUES, np.float32(max_val), side="right")
+    if hi == lo:
+        # 无数据直接返回；避免后续 VTK 构建开销
+        return None, 0, time.time() - t1, 0.0
+    flat_index = SORT_ORDER[lo:hi]
+    scalar_vals = SORTED_VALUES[lo:hi]
+    filter_time = time.time() - t1
+
+    # ===== C. 生成 VTP（二进制） =====
+    t2 = time.time()
+    vtp_bytes = create_vtp_bytes_with_verts(flat_index, scalar_vals)
+    vtp_time = time.time() - t2
+
+    return vtp_bytes, len(flat_index), filter_time, vtp_time
 
 # ----------------------------
-# 接口：生成带 Verts 的 VTP.gz 文件
+# 接口：生成带 Verts 的 VTP 文件（gzip 传输编码）
 # ----------------------------
 @app.route("/generate-vtp", methods=["POST"])
 def generate_vtp():
-    """按阈值筛选三维体数据，生成 vtkPolyData(VTP) 并 gzip 压缩后返回。"""
+    """
+    按阈值筛选三维体数据，生成 vtkPolyData(VTP) 并 gzip 压缩后返回。
+    未命中缓存时以生成器边压缩边分块发送（chunked），发送完成后写入缓存；
+    相同区间再次请求直接返回缓存结果。
+    """
     req_start = time.time()
 
     # ===== A. 参数验证 =====
@@ -208,58 +343,58 @@ def generate_vtp():
         return Response("参数错误：min_val 必须小于 max_val", status=400)
     param_time = time.time() - t0
 
-    # ===== B. 数据筛选（向量化掩码） =====
-    t1 = time.time()
-    mask = (VALUES_FLAT >= min_val) & (VALUES_FLAT <= max_val)
-    x_vals, y_vals, z_vals, scalar_vals = (
-        X_FLAT[mask],
-        Y_FLAT[mask],
-        Z_FLAT[mask],
-        VALUES_FLAT[mask]
-    )
-    if len(x_vals) == 0:
-        # 无数据直接返回；避免后续 VTK 构建开销
+    # 区间落在全局值域之外：无需查缓存与二分查找（按 float32 比较，与二分查找的判定一致）
+    if np.float32(min_val) > GLOBAL_MAX or np.float32(max_val) < GLOBAL_MIN:
         return Response("范围内无数据", status=400)
-    filter_time = time.time() - t1
 
-    # ===== C. 生成 VTP（二进制） =====
-    t2 = time.time()
-    vtp_bytes = create_vtp_bytes_with_verts(x_vals, y_vals, z_vals, scalar_vals)
-    vtp_time = time.time() - t2
+    # 以 Content-Encoding 声明 gzip，浏览器 / fetch 层自动解压，前端拿到的即原始 VTP
+    headers = {"Content-Encoding": "gzip", "Content-Disposition": "attachment; filename=pointcloud.vtp"}
+    # 阈值转 float32 后同时作为缓存键与筛选阈值：与筛选核同精度，键相同即选中体素相同，缓存命中结果不变
+    key = (np.float32(min_val), np.float32(max_val))
+
+    # ===== 缓存命中：直接返回已压缩数据 =====
+    cached = cache_get(key)
+    if cached is not None:
+        gz_data, n_points, original_size = cached
+        logging.info(
+            "请求完成(缓存命中): 范围=(%s,%s) 点数=%d 压缩后=%.2fMB 总耗时=%.3fs",
+            min_val, max_val, n_points, len(gz_data) / 1024 / 1024, time.time() - req_start
+        )
+        return Response(gz_data, content_type="application/vnd.vtp+xml", headers=headers)
+
+    # ===== B-C. 筛选 + 生成 VTP =====
+    vtp_bytes, n_points, filter_time, vtp_time = build_vtp(*key)
+    if vtp_bytes is None:
+        return Response("范围内无数据", status=400)
 
-    # ===== D. gzip 压缩 =====
-    t3 = time.time()
-    gz_data = gzip_bytes(vtp_bytes)
-    compress_time = time.time() - t3
-
-    # ===== E. 体量与耗时统计 =====
-    original_size = len(vtp_bytes)
-    compressed_size = len(gz_data)
-    compression_ratio = 100 * (1 - compressed_size / original_size)
-    total_time = time.time() - req_start
-
-    # 记录详细流水信息，方便线上观测
-    logging.info(
-        f"请求完成: 范围=({min_val},{max_val}) "
-        f"点数={len(x_vals)} "
-        f"参数验证={param_time:.3f}s "
-        f"筛选={filter_time:.3f}s "
-        f"VTP生成={vtp_time:.3f}s "
-        f"压缩={compress_time:.3f}s "
-        f"原始大小={original_size/1024/1024:.2f}MB "
-        f"压缩后={compressed_size/1024/1024:.2f}MB "
-        f"压缩率={compression_ratio:.1f}% "
-        f"总耗时={total_time:.3f}s"
-    )
-
-    # ===== F. 返回 gzip 压缩的 VTP 文件 =====
-    return Response(
-        gz_data,
-        mimetype="application/gzip",
-        headers={
-            "Content-Disposition": "attachment; filename=pointcloud.vtp.gz"
-        }
-    )
+    # ===== D. 边压缩边发送，完成后统计并写入缓存 =====
+    def stream():
+        t3 = time.time()
+        frames = []
+        for frame in gzip_frames(vtp_bytes):
+            frames.append(frame)
+            yield frame
+        compress_time = time.time() - t3
+
+        gz_data = b"".join(frames)
+        original_size = len(vtp_bytes)
+        cache_put(key, (gz_data, n_points, original_size))
+
+        # ===== E. 体量与耗时统计 =====
+        compressed_size = len(gz_data)
+        compression_ratio = 100 * (1 - compressed_size / original_size)
+        total_time = time.time() - req_start
+
+        # 记录详细流水信息，方便线上观测（压缩耗时含发送）；参数延迟格式化，日志级别关闭时不产生开销
+        logging.info(
+            "请求完成: 范围=(%s,%s) 点数=%d 参数验证=%.3fs 筛选=%.3fs VTP生成=%.3fs 压缩=%.3fs "
+            "原始大小=%.2fMB 压缩后=%.2fMB 压缩率=%.1f%% 总耗时=%.3fs",
+            min_val, max_val, n_points, param_time, filter_time, vtp_time, compress_time,
+            original_size / 1024 / 1024, compressed_size / 1024 / 1024, compression_ratio, total_time
+        )
+
+    # ===== F. 返回 gzip 压缩的 VTP 文件（分块传输） =====
+    return Response(stream(), content_type="application/vnd.vtp+xml", headers=headers)
 
 # ===============================
 # 新增接口：保存前端渲染日志到磁盘
@@ -287,10 +422,10 @@ def save_log():
         with open(log_path, "w", encoding="utf-8") as f:
             f.write("\n".join(logs))
 
-        logging.info(f"前端日志已保存: {log_path}")
+        logging.info("前端日志已保存: %s", log_path)
         return jsonify({"status": "ok", "path": log_path})
     except Exception as e:
-        logging.error(f"保存前端日志失败: {e}", exc_info=True)
+        logging.error("保存前端日志失败: %s", e, exc_info=True)
         return jsonify({"status": "error", "msg": str(e)}), 500
 
 # ----------------------------
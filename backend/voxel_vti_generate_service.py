@@ -4,47 +4,56 @@
     基于 Flask 的点云/体数据处理服务，按给定阈值区间(min_val, max_val)对三维体素数据进行筛选：
       - 将不在范围内的体素标量值置 0（保留拓扑与坐标不变）
       - 使用 VTK 生成 VTI（VTK ImageData 的 XML）二进制数据
-      - 使用 gzip 压缩后通过 HTTP 直接返回（不落盘）
+      - 使用 gzip 压缩后通过 HTTP 直接返回（不落盘），以 Content-Encoding: gzip 声明，由浏览器透明解压
 
 主要优化点：
     1) 使用 VTK 生成 VTI（体素结构，规则网格），包含点坐标与标量值（ScalarValue）。
     2) 日志明确 UTF-8 编码，便于中文日志收集。
-    3) 记录各阶段耗时：参数校验 / Numba 加速筛选 / VTI 生成 / 压缩 / 总耗时。
-    4) 使用 Numba(@jit, nopython=True) 加速阈值处理（将不在范围内的值置 0）。
-    5) 使用线程池对写出与压缩过程进行封装（注意：当前实现立即 .result()，非完全异步，仅在线程中执行）。
-    6) 启动时预加载并缓存原始数据（VALUES_FLAT），避免每次请求重复 IO 与重排。
+    3) 记录各阶段耗时：参数校验 / 阈值筛选 / VTI 生成 / 压缩 / 总耗时。
+    4) 阈值处理（将不在范围内的值置 0）在常驻缓冲区 SCALAR_BUF 上增量完成：先还原上次置 0 的位置，
+       越界体素较少时只按下标散射置 0，较多时才整卷重写，避免每次请求整卷拷贝。
+    5) 写出后分段压缩，以生成器逐段分块发送（chunked），客户端无需等待整份压缩完成即可开始接收。
+    6) 启动时将 Saltf 一次性转换为小端副本（Saltf.f32）并只读内存映射为 VALUES_FLAT，
+       多进程共享页缓存，避免每次请求重复 IO 与重排。
+    7) 按阈值区间（float32 阈值，即筛选实际使用的精度）LRU 缓存压缩后的 VTI，重复区间直接返回，不再筛选与写出。
+    8) vtkImageData / 标量数组 / Writer 启动时预构建，标量数组直接引用 SCALAR_BUF，请求间不再重建对象或深拷贝整卷。
 
 输入/输出与数据流：
     启动阶段：
-        Saltf(>f4) -> np.fromfile -> reshape(Z,Y,X) -> byteswap().view(float32) -> flatten -> VALUES_FLAT
+        Saltf(>f4) -> （首次）复制并原地 byteswap -> Saltf.f32 -> np.memmap(float32, 只读) -> ravel -> VALUES_FLAT
+        VALUES_FLAT -> np.histogram(4096 箱) -> HIST_EDGES / HIST_CUMSUM
+        VALUES_FLAT -> uint16 量化 -> VALUES_Q
     请求 /generate-vti：
         JSON(min_val, max_val) -> 参数校验
-        -> Numba filter_values(VALUES_FLAT, min_val, max_val) 将越界值置 0
-        -> 构建 vtkImageData(dims, spacing, origin) + 设置标量 ScalarValue
-        -> vtkXMLImageDataWriter 二进制写出 -> gzip 压缩 -> send_file 返回 .vti.gz
+        -> 直方图估计命中数：全部不命中（含区间落在全局值域外）直接 400，全部命中时跳过扫描
+        -> refresh_scalar_buffer：还原上次越界位置，numba 并行在 VALUES_Q 上粗判越界、边界桶精确比较，
+           再将本次越界值置 0（散射或整卷重写）
+        -> 预构建的 IMAGE_DATA（标量 ScalarValue 引用 SCALAR_BUF）标记修改
+        -> VTI_WRITER 二进制写出 -> gzip 分段压缩并分块发送（Content-Encoding: gzip，发送完成后按区间写入 LRU 缓存）
 
 注意事项与潜在风险：
     - dims/spacing/origin 必须与真实数据一致，否则坐标解读错误。
-    - Saltf 为大端 float32（>f4），读入后需 byteswap 转为本机小端 float32。
-    - 线程池当前通过 future.result() 阻塞等待结果，属于“异步封装”而非并发流水；若希望真正异步，应改为后台任务/队列。
+    - Saltf 为大端 float32（>f4），启动时转换为同目录下的小端副本 Saltf.f32（需可写）；Saltf 更新后自动重建。
+    - 若前置 nginx 等反向代理，可改由代理压缩（gzip_types application/vnd.vti+xml），服务端直接返回原始 VTI。
+    - 分块发送开始后响应头已发出，压缩阶段的异常只能记录日志并中断传输，无法再返回 500。
     - VTK 写出字符串在不同版本中类型可能不同（bytes/str），本实现按 str->encode 处理；如返回本就是 bytes，需分支判断。
-    - Numba @jit 首次调用存在编译开销；生产环境可通过预热一次调用降低首次请求延迟。
+    - SCALAR_BUF / LAST_DIRTY 为全局共享状态，由 SCALAR_LOCK 串行化，从更新到 VTI 写出完成之间持锁（预构建的 VTK 对象同样受该锁保护）。
     - 该服务对大规模体数据（210×676×676）内存与 CPU 压力较大，建议结合分块/阈值预计算/缓存策略。
 """
 
-from flask import Flask, request, Response, send_file
+from flask import Flask, request, Response
 from io import BytesIO
 import numpy as np
-import vtk
 from vtk import vtkXMLImageDataWriter, vtkImageData, vtkFloatArray
-from vtkmodules.util import numpy_support
 from flask_cors import CORS
 import os
+import shutil
 import time
 import logging
 import gzip
-from concurrent.futures import ThreadPoolExecutor
-from numba import jit
+import threading
+from collections import OrderedDict
+from numba import njit, prange
 
 # =========================
 # Flask 初始化与跨域设置
@@ -72,70 +81,331 @@ origin = (0.0, 0.0, 0.0)         # 原点坐标
 input_file = "Saltf"             # 源数据文件名（大端 float32, >f4）
 
 # =========================
-# 全局缓存：展平后的标量数组
+# 全局缓存：展平后的标量数组与值分布直方图
 # =========================
 VALUES_FLAT = None
+HIST_BINS = 4096                 # 直方图分箱数
+HIST_EDGES = None                # 分箱边界（HIST_BINS + 1 个）
+HIST_CUMSUM = None               # 累计计数，首项补 0：区间 [a, b) 箱计数 = HIST_CUMSUM[b] - HIST_CUMSUM[a]
+GLOBAL_MIN = None                # 全卷最小值（Python 标量，即 HIST_EDGES[0]）
+GLOBAL_MAX = None                # 全卷最大值（Python 标量，即 HIST_EDGES[-1]）
+SCALAR_BUF = None                # 常驻输出缓冲区：VALUES_FLAT 的副本，越界位置置 0
+LAST_DIRTY = None                # 上次请求置 0 的下标（int32）；None 表示整卷均可能被改写
+SCATTER_LIMIT = None             # 越界体素数不超过该值时按下标散射，否则整卷重写
+Q_LEVELS = 65535                 # 量化级数上限（uint16）
+Q_MIN = None                     # 量化基准：全卷最小值（float32）
+Q_SCALE = None                   # 量化比例：Q_LEVELS / (最大值 - 最小值)（float32）
+VALUES_Q = None                  # VALUES_FLAT 的 uint16 量化码，阈值粗判只读该数组
 
-@jit(nopython=True)
-def filter_values(values_flat, min_val, max_val):
+def quantize(val):
     """
-    使用 Numba 加速的阈值过滤函数：将不在 [min_val, max_val] 范围内的值置 0。
-    说明：
-        - 采用拷贝后原地修改，避免污染全局缓存（values_flat）。
-        - 返回与输入等长的一维数组，可直接写入 VTK 标量。
+    将阈值按与 VALUES_Q 相同的 float32 运算量化为 uint16 码（截断到 [0, Q_LEVELS]）。
+    量化单调不减，因此码严格落在 (q(min_val), q(max_val)) 之间的体素必然命中，
+    码在该闭区间之外的必然不命中，只有码等于两端的边界桶需用原始值精确比较。
+    """
+    level = (np.float32(val) - Q_MIN) * Q_SCALE
+    return int(min(max(level, 0.0), Q_LEVELS))
+
+SELECT_CHUNKS = 1024             # 并行筛选的分块数：各块先计数，前缀和后写入各自的输出区段
+
+@njit(inline='always')
+def is_out_of_range(q, v, q_min, q_span, min_val, max_val):
+    """
+    单个体素是否越界：量化码在边界桶之外直接判定，落在边界桶时用原始值精确比较。
+    码区间 [q_min, q_min + q_span] 的两次比较合并为一次无符号比较：q - q_min 为负时回绕成极大值，
+    与超出上界一样大于 q_span。原始值比较仍保留两端判断，保证与 min_val <= v <= max_val 逐位一致。
+    """
+    d = np.uint64(np.int64(q) - q_min)
+    if d > q_span:
+        return True
+    if d == 0 or d == q_span:
+        return v < min_val or v > max_val
+    return False
+
+@njit(parallel=True, cache=True, boundscheck=False)
+def count_out_of_range(values_q, values, q_min, q_span, min_val, max_val, n_chunks):
+    """第一遍：按块并行统计越界体素数，返回 int64[n_chunks]。"""
+    n = values_q.shape[0]
+    chunk = (n + n_chunks - 1) // n_chunks
+    counts = np.zeros(n_chunks, dtype=np.int64)
+    for c in prange(n_chunks):
+        total = 0
+        for i in range(c * chunk, min((c + 1) * chunk, n)):
+            if is_out_of_range(values_q[i], values[i], q_min, q_span, min_val, max_val):
+                total += 1
+        counts[c] = total
+    return counts
+
+@njit(parallel=True, cache=True, boundscheck=False)
+def gather_out_of_range(values_q, values, q_min, q_span, min_val, max_val, counts):
+    """第二遍：按各块计数的前缀和定位输出区段，并行写出越界体素下标（int32，升序）。"""
+    n = values_q.shape[0]
+    n_chunks = counts.shape[0]
+    chunk = (n + n_chunks - 1) // n_chunks
+    starts = np.empty(n_chunks, dtype=np.int64)
+    total = 0
+    for c in range(n_chunks):
+        starts[c] = total
+        total += counts[c]
+    index = np.empty(total, dtype=np.int32)
+    for c in prange(n_chunks):
+        k = starts[c]
+        for i in range(c * chunk, min((c + 1) * chunk, n)):
+            if is_out_of_range(values_q[i], values[i], q_min, q_span, min_val, max_val):
+                index[k] = i
+                k += 1
+    return index
+
+@njit(parallel=True, cache=True, boundscheck=False)
+def write_in_range(values_q, values, q_min, q_span, min_val, max_val, out):
+    """整卷重写：命中体素取原值，越界体素置 0，并行写入 out。"""
+    for i in prange(values_q.shape[0]):
+        if is_out_of_range(values_q[i], values[i], q_min, q_span, min_val, max_val):
+            out[i] = 0.0
+        else:
+            out[i] = values[i]
+
+def match_count_bounds(min_val, max_val):
+    """
+    基于启动时的直方图估计 [min_val, max_val] 内的体素数，O(分箱数) 而无需扫描体数据。
+    下界只累计完全落在区间内的分箱，上界累计与区间相交的分箱；
+    下界等于总体素数即全部命中，上界为 0 即全部不命中。
+
+    Returns:
+        tuple[int, int]: (命中数下界, 命中数上界)
+    """
+    # 阈值转 float32，与体素及筛选核同精度比较，避免边界上的判定不一致
+    min_val, max_val = np.float32(min_val), np.float32(max_val)
+    if max_val < GLOBAL_MIN or min_val > GLOBAL_MAX:
+        return 0, 0
+    n_bins = len(HIST_EDGES) - 1
+    # 完全落在区间内的分箱：左边界 >= min_val 且右边界 <= max_val
+    full_lo = np.searchsorted(HIST_EDGES, min_val, side='left')
+    full_hi = np.searchsorted(HIST_EDGES, max_val, side='right') - 1
+    lower = HIST_CUMSUM[full_hi] - HIST_CUMSUM[full_lo] if full_hi > full_lo else 0
+    # 与区间相交的分箱：右边界 > min_val（末箱为闭区间）且左边界 <= max_val
+    touch_lo = min(max(np.searchsorted(HIST_EDGES, min_val, side='right') - 1, 0), n_bins - 1)
+    touch_hi = min(np.searchsorted(HIST_EDGES, max_val, side='right'), n_bins)
+    upper = HIST_CUMSUM[touch_hi] - HIST_CUMSUM[touch_lo]
+    return int(lower), int(upper)
+
+def refresh_scalar_buffer(min_val, max_val, match_lower, match_upper):
+    """
+    将 SCALAR_BUF 更新为本次阈值结果（越界置 0），调用方须持有 SCALAR_LOCK。
+    先还原上次请求置 0 的位置，再只对本次越界的体素按下标置 0；
+    越界体素超过 SCATTER_LIMIT 时散射不再划算，改为整卷重写，并记 LAST_DIRTY 为 None。
 
     Args:
-        values_flat (np.ndarray): 展平的标量数组（float32）
-        min_val (float): 最小阈值（含）
-        max_val (float): 最大阈值（含）
+        min_val, max_val         : 阈值区间（含端点）
+        match_lower, match_upper : match_count_bounds 给出的命中数上下界
     Returns:
-        np.ndarray: 处理后的标量数组（不在范围的项被置 0）
+        np.ndarray: SCALAR_BUF
     """
-    result = np.copy(values_flat)
-    for i in range(len(result)):
-        if result[i] < min_val or result[i] > max_val:
-            result[i] = 0.0
-    return result
+    global LAST_DIRTY
+
+    def restore():
+        if LAST_DIRTY is None:
+            np.copyto(SCALAR_BUF, VALUES_FLAT)
+        else:
+            SCALAR_BUF[LAST_DIRTY] = VALUES_FLAT[LAST_DIRTY]
+
+    if match_lower == len(VALUES_FLAT):
+        # 全部命中：只需还原
+        restore()
+        LAST_DIRTY = np.empty(0, dtype=np.int32)
+    elif match_upper == 0:
+        # 全部不命中：整卷置 0
+        SCALAR_BUF.fill(0.0)
+        LAST_DIRTY = None
+    else:
+        # 在 uint16 量化码上粗判（内存流量为 float32 的一半），两端边界桶用原始值精确比较；
+        # numba 并行单遍完成比较与计数，阈值按 float32 传入，与量化运算一致；
+        # 比较在 float32 下进行（含端点）：等于 float32(max_val) 的体素保留，而非按 float64 阈值置 0，与 PLY/VTP 一致
+        q_min = quantize(min_val)
+        q_span = np.uint64(quantize(max_val) - q_min)
+        lo, hi = np.float32(min_val), np.float32(max_val)
+        counts = count_out_of_range(VALUES_Q, VALUES_FLAT, q_min, q_span, lo, hi, SELECT_CHUNKS)
+        if counts.sum() <= SCATTER_LIMIT:
+            dirty = gather_out_of_range(VALUES_Q, VALUES_FLAT, q_min, q_span, lo, hi, counts)
+            restore()
+            SCALAR_BUF[dirty] = 0.0
+            LAST_DIRTY = dirty
+        else:
+            # 整卷重写：命中体素取原值、越界置 0，无需先还原
+            write_in_range(VALUES_Q, VALUES_FLAT, q_min, q_span, lo, hi, SCALAR_BUF)
+            LAST_DIRTY = None
+    return SCALAR_BUF
 
 # =========================
 # 启动时加载与缓存体数据
 # =========================
 try:
     init_start = time.time()
-    # 1) 从大端 float32 文件读取一维数组
-    raw_data = np.fromfile(input_file, dtype=">f4")
+    # 1) 校验文件体素数（按文件大小，无需读入数据）
     expected_size = dims[0] * dims[1] * dims[2]
-    if len(raw_data) != expected_size:
+    actual_size = os.path.getsize(input_file) // 4
+    if actual_size != expected_size:
         # 尺寸不匹配：通常是 dims 配置或输入文件有误
-        raise ValueError(f"预期数据量 {expected_size}，实际得到 {len(raw_data)}")
+        raise ValueError(f"预期数据量 {expected_size}，实际得到 {actual_size}")
+
+    # 2) 首次启动（或 Saltf 更新后）生成本机小端副本 <input_file>.f32：
+    #    复制后以可写内存映射原地交换字节序，不经 Python 堆；写入临时文件再原子替换，避免并发进程读到半成品
+    converted_file = input_file + ".f32"
+    if not os.path.exists(converted_file) or os.path.getmtime(converted_file) < os.path.getmtime(input_file):
+        tmp_file = f"{converted_file}.{os.getpid()}.tmp"
+        shutil.copyfile(input_file, tmp_file)
+        swapped = np.memmap(tmp_file, dtype=">f4", mode="r+")
+        swapped.byteswap(inplace=True)
+        swapped.flush()
+        del swapped
+        os.replace(tmp_file, converted_file)
+
+    # 3) 只读内存映射小端副本并展平（ravel 为视图）：数据由操作系统页缓存按需换入，
+    #    多个 worker 进程共享同一份物理内存，启动时无需整卷读盘
+    raw_data = np.memmap(converted_file, dtype=np.float32, mode="r", shape=(dims[2], dims[1], dims[0]))
+    VALUES_FLAT = raw_data.ravel()
 
-    # 2) 重塑为 (Z, Y, X) 并转为本机小端 float32
-    raw_data = raw_data.reshape((dims[2], dims[1], dims[0])).byteswap().view(np.float32)
+    # 4) 一次性统计值分布直方图，请求时据此判断全部命中/全部不命中，跳过整卷扫描
+    hist, HIST_EDGES = np.histogram(VALUES_FLAT, bins=HIST_BINS)
+    HIST_CUMSUM = np.concatenate(([0], np.cumsum(hist)))
+    GLOBAL_MIN = float(HIST_EDGES[0])
+    GLOBAL_MAX = float(HIST_EDGES[-1])
 
-    # 3) 展平缓存，后续请求基于该数组生成不同阈值视图
-    VALUES_FLAT = raw_data.flatten()
+    # 5) 阈值结果常驻缓冲区：请求间共享，只增量改写越界位置
+    SCALAR_BUF = VALUES_FLAT.copy()
+    LAST_DIRTY = np.empty(0, dtype=np.int32)
+    SCATTER_LIMIT = len(VALUES_FLAT) // 4
+    SCALAR_LOCK = threading.Lock()
+
+    # 6) uint16 量化码：code = trunc((value - 最小值) × 比例)，阈值筛选的整卷比较只读 2 字节/体素
+    Q_MIN = np.float32(HIST_EDGES[0])
+    value_span = np.float32(HIST_EDGES[-1]) - Q_MIN
+    Q_SCALE = np.float32(Q_LEVELS / value_span) if value_span > 0 else np.float32(0.0)
+    levels = VALUES_FLAT - Q_MIN
+    levels *= Q_SCALE
+    np.clip(levels, 0, Q_LEVELS, out=levels)
+    VALUES_Q = levels.astype(np.uint16)
+    del levels
+
+    # 7) 预热 numba 筛选内核（参数类型与请求时一致），避免首个请求承担编译开销
+    warm_q = np.zeros(1024, dtype=np.uint16)
+    warm_v = np.zeros(1024, dtype=np.float32)
+    warm_v.flags.writeable = False   # VALUES_FLAT 为只读映射，numba 按只读数组类型单独编译
+    warm_counts = count_out_of_range(warm_q, warm_v, 0, np.uint64(0), np.float32(0.0), np.float32(0.0), SELECT_CHUNKS)
+    gather_out_of_range(warm_q, warm_v, 0, np.uint64(0), np.float32(0.0), np.float32(0.0), warm_counts)
+    write_in_range(warm_q, warm_v, 0, np.uint64(0), np.float32(0.0), np.float32(0.0), np.empty(1024, dtype=np.float32))
 
     init_time = time.time() - init_start
-    logging.info(f"初始化完成，数据已缓存，耗时：{init_time:.3f}秒")
+    logging.info("初始化完成，数据已缓存，耗时：%.3f秒", init_time)
 except Exception as e:
-    logging.error(f"初始化失败：{str(e)}", exc_info=True)
+    logging.error("初始化失败：%s", e, exc_info=True)
     raise
 
 # =========================
-# 线程池：封装写出与压缩任务
+# 结果缓存：同一阈值区间直接复用已压缩的 VTI
 # =========================
-executor = ThreadPoolExecutor(max_workers=4)
+VTI_CACHE_SIZE = 4               # 每项为整卷 VTI 的 gzip 数据，体积较大，只保留少量
+VTI_CACHE = OrderedDict()        # (min_val, max_val) -> gzip 数据，按最近使用排序
+VTI_CACHE_LOCK = threading.Lock()
+GZIP_CHUNK_SIZE = 1 << 20        # 每次编码并送入压缩器的字符数（1 MB）
+
+def cache_get(key):
+    """取缓存项并标记为最近使用；未命中返回 None。"""
+    with VTI_CACHE_LOCK:
+        entry = VTI_CACHE.get(key)
+        if entry is not None:
+            VTI_CACHE.move_to_end(key)
+        return entry
+
+def cache_put(key, entry):
+    """写入缓存项，超出容量时淘汰最久未使用的项。"""
+    with VTI_CACHE_LOCK:
+        VTI_CACHE[key] = entry
+        VTI_CACHE.move_to_end(key)
+        while len(VTI_CACHE) > VTI_CACHE_SIZE:
+            VTI_CACHE.popitem(last=False)
+
+# =========================
+# VTK 对象预构建：ImageData / 标量数组 / Writer 启动时建好，请求间复用
+# 标量数组以 SetVoidArray（save=1）直接引用常驻缓冲区 SCALAR_BUF，不再逐请求深拷贝整卷；
+# 这些对象与 SCALAR_BUF 一样由 SCALAR_LOCK 串行化
+# =========================
+IMAGE_DATA = vtkImageData()
+IMAGE_DATA.SetDimensions(dims[0], dims[1], dims[2])      # X, Y, Z
+IMAGE_DATA.SetSpacing(spacing[0], spacing[1], spacing[2])
+IMAGE_DATA.SetOrigin(origin[0], origin[1], origin[2])
+SCALAR_ARRAY = vtkFloatArray()                            # float32，与 SCALAR_BUF 对齐
+SCALAR_ARRAY.SetName("ScalarValue")
+SCALAR_ARRAY.SetVoidArray(SCALAR_BUF, len(SCALAR_BUF), 1)
+IMAGE_DATA.GetPointData().SetScalars(SCALAR_ARRAY)
+
+VTI_WRITER = vtkXMLImageDataWriter()
+VTI_WRITER.SetDataModeToBinary()     # 二进制写出
+VTI_WRITER.WriteToOutputStringOn()   # 输出到内存字符串
+EMPTY_IMAGE = vtkImageData()         # 写出后用于清空 writer 内部保留的输出字符串
+
+def write_vti(min_val, max_val):
+    """
+    按阈值区间筛选（越界体素置 0）并写出 VTI（二进制）。
+    流程：
+      B. 增量筛选（常驻缓冲区上越界置 0）
+      C. 预构建的 IMAGE_DATA 直接引用 SCALAR_BUF，标记修改后由 VTI_WRITER 写出
+    兼容说明：
+        - 某些 VTK 版本的 writer.GetOutputString() 可能返回 bytes，
+          当前实现默认按 str 处理（压缩时分段 encode）；若上线遇到类型不符，需分支判断。
+
+    Returns:
+        tuple: (VTI 字符串, 命中数下界, 命中数上界, 筛选耗时, VTI 写出耗时)
+    """
+    # ===== B. 增量筛选（越界置 0）=====
+    # 直方图判定全部命中/全部不命中时无需逐体素比较；其余情况在常驻缓冲区上增量置 0，
+    # 持锁直至 VTI 写出完成（writer 直接读取 SCALAR_BUF）
+    with SCALAR_LOCK:
+        filter_start = time.time()
+        match_lower, match_upper = match_count_bounds(min_val, max_val)
+        refresh_scalar_buffer(min_val, max_val, match_lower, match_upper)
+        filter_time = time.time() - filter_start
+
+        # ===== C. 写出 VTI（规则体素网格）=====
+        vti_start = time.time()
+        SCALAR_ARRAY.Modified()
+        VTI_WRITER.SetInputData(IMAGE_DATA)
+        VTI_WRITER.Write()
+        vti_data = VTI_WRITER.GetOutputString()
+        # writer 会一直保留上次的输出字符串；写出一次空图像将其换成几百字节，避免请求间常驻整卷 VTI
+        VTI_WRITER.SetInputData(EMPTY_IMAGE)
+        VTI_WRITER.Write()
+        vti_time = time.time() - vti_start
+
+    return vti_data, match_lower, match_upper, filter_time, vti_time
+
+def compressed_vti_frames(vti_data):
+    """
+    将 VTI 字符串 gzip 压缩，边压缩边逐段产出压缩后的 bytes（生成器）。
+    输出字符串分段编码后送入压缩器，不再整体 encode 出一份完整副本。
+    """
+    buffer = BytesIO()
+    # 采用较低压缩级别以缩短 CPU 时间（体积与耗时的折中）
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=1) as gz:
+        for start in range(0, len(vti_data), GZIP_CHUNK_SIZE):
+            gz.write(vti_data[start:start + GZIP_CHUNK_SIZE].encode('utf-8'))
+            frame = buffer.getvalue()
+            if frame:
+                yield frame
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()  # gzip 尾部（CRC 与长度）
 
 @app.route('/generate-vti', methods=['POST'])
 def generate_vti():
     """
-    按阈值范围生成 .vti.gz（VTK ImageData + gzip）并返回下载。
+    按阈值范围生成 VTI（VTK ImageData，gzip 传输编码）并返回下载。
     流程：
       A. 参数校验
-      B. Numba 加速筛选（置 0）
-      C. 构建 vtkImageData 并绑定标量
-      D. 在线程中写出 VTI（二进制）并 gzip 压缩
-      E. 统计耗时并返回
+      B-C. write_vti：筛选并以预构建的 vtkImageData 写出 VTI（二进制）
+      D. 边压缩边分块发送，发送完成后按区间写入 LRU 缓存
+      E. 统计耗时
+    相同区间再次请求直接返回缓存的压缩数据。
 
     请求体(JSON)：
         {
@@ -151,90 +421,66 @@ def generate_vti():
     min_val = data.get("min_val")
     max_val = data.get("max_val")
     if not isinstance(min_val, (int, float)) or not isinstance(max_val, (int, float)):
-        logging.error(f"无效参数：min_val={min_val}, max_val={max_val}")
+        logging.error("无效参数：min_val=%s, max_val=%s", min_val, max_val)
         return Response("无效的 min_val 或 max_val 参数", status=400)
     if min_val >= max_val:
-        logging.error(f"范围错误：min_val={min_val} >= max_val={max_val}")
+        logging.error("范围错误：min_val=%s >= max_val=%s", min_val, max_val)
         return Response("min_val 必须小于 max_val", status=400)
     param_time = time.time() - param_start
 
-    try:
-        # ===== B. Numba 加速筛选（越界置 0）=====
-        filter_start = time.time()
-        scalar_vals = filter_values(VALUES_FLAT, min_val, max_val)
-        filter_time = time.time() - filter_start
+    # 以 Content-Encoding 声明 gzip，浏览器 / fetch 层自动解压，前端拿到的即原始 VTI
+    headers = {"Content-Encoding": "gzip", "Content-Disposition": "attachment; filename=pointcloud.vti"}
+    # 阈值转 float32 后同时作为缓存键与筛选阈值：与筛选核同精度，键相同即选中体素相同，缓存命中结果不变
+    key = (np.float32(min_val), np.float32(max_val))
 
-        # ===== C. 构建 VTI（规则体素网格）=====
-        vti_start = time.time()
-        image_data = vtkImageData()
-        image_data.SetDimensions(dims[0], dims[1], dims[2])      # X, Y, Z
-        image_data.SetSpacing(spacing[0], spacing[1], spacing[2])
-        image_data.SetOrigin(origin[0], origin[1], origin[2])
-
-        # 将 numpy 数组转为 VTK 数组并绑定为点数据的标量
-        # 注意：array_type 指定为 VTK_FLOAT，确保与 numpy float32 对齐
-        vtk_array = numpy_support.numpy_to_vtk(
-            num_array=scalar_vals,
-            deep=True,
-            array_type=vtk.VTK_FLOAT
+    # ===== 空区间短路：直方图判定无命中体素时直接返回，不扫描体数据也不构建 VTI =====
+    if match_count_bounds(*key)[1] == 0:
+        logging.info("范围内无数据：范围=(%s,%s)", min_val, max_val)
+        return Response("范围内无数据", status=400)
+
+    # ===== 缓存命中：直接返回已压缩数据 =====
+    cached = cache_get(key)
+    if cached is not None:
+        logging.info(
+            "请求处理完成(缓存命中)：范围=(%s,%s) 压缩后大小=%.2fMB 总耗时=%.3f秒",
+            min_val, max_val, len(cached) / 1024 / 1024, time.time() - start_time
         )
-        vtk_array.SetName("ScalarValue")
-        image_data.GetPointData().SetScalars(vtk_array)
-        vti_time = time.time() - vti_start
+        return Response(cached, content_type='application/vnd.vti+xml', headers=headers)
 
-        # ===== D. 在线程中写出 VTI（二进制）并 gzip 压缩 =====
-        def write_compressed_vti():
-            """
-            线程函数：将 image_data 写为 VTI（二进制）并使用 gzip 压缩。
-            兼容说明：
-                - 某些 VTK 版本的 writer.GetOutputString() 可能返回 bytes，
-                  当前实现默认按 str.encode('utf-8') 处理；若上线遇到类型不符，
-                  可改为：
-                      data = writer.GetOutputString()
-                      if isinstance(data, str): data = data.encode('utf-8')
-                      gz.write(data)
-            """
-            buffer = BytesIO()
-            writer = vtkXMLImageDataWriter()
-            writer.SetInputData(image_data)
-            writer.SetDataModeToBinary()     # 二进制写出
-            writer.WriteToOutputStringOn()   # 输出到内存字符串
-            writer.Write()
-            vti_data = writer.GetOutputString()
-            # 采用较低压缩级别以缩短 CPU 时间（体积与耗时的折中）
-            with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=1) as gz:
-                gz.write(vti_data.encode('utf-8'))  # 见上方兼容说明
-            buffer.seek(0)
-            return buffer
+    try:
+        # ===== B-C. 筛选并写出 VTI =====
+        vti_data, match_lower, match_upper, filter_time, vti_time = write_vti(*key)
+    except Exception as e:
+        # 捕获处理链路中的所有异常，写入堆栈便于定位
+        logging.error("处理失败：min_val=%s, max_val=%s, 错误=%s", min_val, max_val, e, exc_info=True)
+        return Response(f"服务器错误：{str(e)}", status=500)
 
+    # ===== D. 边压缩边发送，完成后写入缓存 =====
+    def stream():
         compress_start = time.time()
-        # 说明：此处 .result() 会等待线程任务完成，属于“同步等待线程结果”
-        # 若要真正异步，应返回任务ID并由客户端轮询或使用后台队列。
-        future = executor.submit(write_compressed_vti)
-        compressed_output = future.result()
+        frames = []
+        try:
+            for frame in compressed_vti_frames(vti_data):
+                frames.append(frame)
+                yield frame
+        except Exception as e:
+            # 响应头已发出，只能记录日志并中断传输
+            logging.error("处理失败：min_val=%s, max_val=%s, 错误=%s", min_val, max_val, e, exc_info=True)
+            raise
         compress_time = time.time() - compress_start
+        cache_put(key, b"".join(frames))
 
-        # ===== E. 统计日志并返回 =====
+        # ===== E. 统计日志 =====
         total_time = time.time() - start_time
+        # 参数延迟格式化，日志级别关闭时不产生开销
         logging.info(
-            f"请求处理完成：范围=({min_val},{max_val}) 点数={len(scalar_vals)} "
-            f"参数验证耗时={param_time:.3f}秒 筛选耗时={filter_time:.3f}秒 "
-            f"VTI生成耗时={vti_time:.3f}秒 压缩耗时={compress_time:.3f}秒 "
-            f"总耗时={total_time:.3f}秒"
-        )
-
-        return send_file(
-            compressed_output,
-            mimetype='application/gzip',
-            as_attachment=True,
-            download_name='pointcloud.vti.gz'
+            "请求处理完成：范围=(%s,%s) 点数=%d 命中数估计=[%d,%d] 参数验证耗时=%.3f秒 筛选耗时=%.3f秒 "
+            "VTI写出耗时=%.3f秒 压缩耗时=%.3f秒 总耗时=%.3f秒",
+            min_val, max_val, len(VALUES_FLAT), match_lower, match_upper, param_time, filter_time,
+            vti_time, compress_time, total_time
         )
 
-    except Exception as e:
-        # 捕获处理链路中的所有异常，写入堆栈便于定位
-        logging.error(f"处理失败：min_val={min_val}, max_val={max_val}, 错误={str(e)}", exc_info=True)
-        return Response(f"服务器错误：{str(e)}", status=500)
-
+    return Response(stream(), content_type='application/vnd.vti+xml', headers=headers)
 
 if __name__ == '__main__':
     # 开发模式启动；生产部署建议使用 WSGI/ASGI（gunicorn/uwsgi 等）并关闭 debug